@@ -4,23 +4,38 @@ Initializes config, login manager, OAuth, the database, registers commands,
 and blueprints.
 
 Methods:
-    create_app() -> Flask object
+    create_app(config) -> Flask object
 """
 
 import os
 import json
 from flask import Flask
 from dotenv import load_dotenv
-from .db import db
-from .tasks import scheduler
-from .utilities import login_manager, add_create_data_command, oauth, init_oauth
+from .db import init_db, upgrade_db, add_db_upgrade_command
+from .tasks import scheduler, leader_election
+from .utilities import (
+    login_manager,
+    add_create_data_command,
+    add_benchmark_commands,
+    add_retention_command,
+    oauth,
+    init_oauth,
+    keyword_extractor,
+    item_cache,
+    metrics_registry,
+    get_ingest_feeds,
+)
 from . import views
 
 
-def create_app():
+def create_app(config=None):
     """
     Creates Flask application and initializes libraries.
 
+    Parameters:
+        config (dict): Settings applied over config.json, such as the ones the
+            ingestion benchmark uses for its temporary database
+
     Returns:
         app: Flask object
     """
@@ -30,6 +45,8 @@ def create_app():
     # Create Flask application and add config from .env and config.json
     app = Flask(__name__)
     app.config.from_file("../config.json", load=json.load, silent=True)
+    if config:
+        app.config.update(config)
     app.secret_key = os.getenv("APP_SECRET_KEY")
 
     # Load Flask-Login
@@ -39,22 +56,49 @@ def create_app():
     oauth.init_app(app)
     init_oauth(oauth)
 
-    # Start scheduler for running tasks (under './tasks')
-    scheduler.init_app(app)
-    scheduler.start()
+    # Configure the shared keyword model, loading it now if set to pre-warm
+    keyword_extractor.init_app(app)
+
+    # Configure the cache of items fetched from the Hacker News API
+    item_cache.init_app(app)
+
+    # Configure where ingestion metrics are shared between worker processes
+    metrics_registry.init_app(app)
+
+    # Start scheduler for running tasks (under './tasks'), unless disabled. One
+    # worker is elected to run the tasks that refresh shared data
+    if app.config.get("SCHEDULER_ENABLED", True):
+        leader_election.init_app(app)
+        leader_election.try_acquire()
+        scheduler.init_app(app)
+        scheduler.start()
 
-    # Initilize Flask app to use database with SQLAlchemy
-    db.init_app(app)
+    # Initilize Flask app to use database with SQLAlchemy, tuned for worker
+    # processes sharing it, upgrading the schema of a database created by an
+    # older version
+    init_db(app)
     with app.app_context():
-        db.create_all()
+        upgrade_db()
+        # A feed the API doesn't have fails here instead of on every page
+        get_ingest_feeds()
 
     # Add command 'create-data to add/update data from Hacker News API into the database
     add_create_data_command(app)
 
+    # Add command 'db-upgrade' to apply schema migrations
+    add_db_upgrade_command(app)
+
+    # Add command 'apply-retention' to archive old stories
+    add_retention_command(app)
+
+    # Add commands for the API replay server and the ingestion benchmark
+    add_benchmark_commands(app)
+
     # Register frontend templates
     app.register_blueprint(views.admin)
     app.register_blueprint(views.home)
     app.register_blueprint(views.login)
+    app.register_blueprint(views.metrics)
     app.register_blueprint(views.profile)
     app.register_blueprint(views.story)
 
@@ -4,3 +4,9 @@ Import module files
 
 from .db import *
 from .models import *
+from .upsert import *
+from .migrations import (
+    upgrade_db,
+    convert_to_incremental_vacuum,
+    add_db_upgrade_command,
+)
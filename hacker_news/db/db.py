@@ -1,10 +1,232 @@
 """
-Defines database object
+Defines database object, tuned for many worker processes sharing one SQLite
+file. Every connection is set up with SQLITE_PRAGMAS, using write-ahead
+logging so pages keep reading while a refresh writes, and connections are kept
+in a pool so they're only set up once. Views marked read only read through
+their own read-only engine, so they never wait for a connection held by a
+refresh. A WAL database can only be opened read only once its -shm file exists
+or can be created, until then those views read through the default engine
+
+Classes:
+    Session
+
+Methods:
+    init_db(app)
+    read_only(view)
+    use_read_only_engine(endpoint, values)
+    can_read(engine)
+    set_pragmas(dbapi_connection, pragmas)
+    get_read_only_url(app, url)
 
 Variables:
     db
+    DEFAULT_PRAGMAS
+    READ_ONLY_PRAGMAS
+    DEFAULT_ENGINE_OPTIONS
 """
 
+import os
+from functools import wraps
+import sqlalchemy as sa
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as BaseSession
+
+# Applied to every connection, SQLITE_PRAGMAS overrides them
+DEFAULT_PRAGMAS = {
+    # Lets retention give freed pages back, only takes effect on new databases
+    # before any table is created, the migrations convert older ones
+    "auto_vacuum": "INCREMENTAL",
+    # Readers and the writer don't block each other
+    "journal_mode": "WAL",
+    # Safe with WAL, only the last commits can be lost in a power failure
+    "synchronous": "NORMAL",
+    # Milliseconds a write waits for another to finish before failing
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    # Negative sizes are in KiB
+    "cache_size": -64 * 1024,
+}
+# Journal settings can only be changed by a connection that can write
+READ_ONLY_PRAGMAS = ["busy_timeout", "mmap_size", "cache_size"]
+# Default options of the engines of SQLite files, SQLALCHEMY_ENGINE_OPTIONS
+# overrides them
+DEFAULT_ENGINE_OPTIONS = {
+    "poolclass": sa.pool.QueuePool,
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    # Pooled connections are handed between the threads of a worker
+    "connect_args": {"check_same_thread": False},
+}
+
+# Read-only engines known to be able to read their database
+_readable_engines = set()
+
+
+class Session(BaseSession):
+    """
+    Session that runs the queries of read-only views on the read-only engine,
+    once it can read the database. Writes, including flushes, always use the
+    default engine
+
+    Methods:
+        get_bind(self, mapper, clause, bind, **kwargs): Select the engine
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and self.info.get("read_only")
+            and not self._flushing
+            and isinstance(clause, sa.sql.Select)
+            and can_read(self._db.engines["read_only"])
+        ):
+            return self._db.engines["read_only"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": Session})
+
+
+def init_db(app):
+    """
+    Initialize the database for a Flask app. SQLite files get pooled engines
+    whose connections are set up with SQLITE_PRAGMAS, and with READ_ONLY_VIEWS,
+    on by default, a read-only engine for read-only views
+
+    Parameters:
+        app: Flask app object
+    """
+    url = sa.engine.make_url(app.config.get("SQLALCHEMY_DATABASE_URI", "sqlite://"))
+    in_memory = url.database in (None, "", ":memory:")
+    read_only_views = app.config.get("READ_ONLY_VIEWS", True)
+    if url.get_backend_name() == "sqlite" and not in_memory:
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            **DEFAULT_ENGINE_OPTIONS,
+            **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+        }
+        if read_only_views:
+            app.config["SQLALCHEMY_BINDS"] = {
+                **app.config.get("SQLALCHEMY_BINDS", {}),
+                "read_only": {
+                    **app.config["SQLALCHEMY_ENGINE_OPTIONS"],
+                    "url": get_read_only_url(app, url),
+                },
+            }
+    db.init_app(app)
+    if url.get_backend_name() != "sqlite" or in_memory:
+        return
+
+    pragmas = {**DEFAULT_PRAGMAS, **app.config.get("SQLITE_PRAGMAS", {})}
+    with app.app_context():
+        sa.event.listen(
+            db.engines[None],
+            "connect",
+            lambda dbapi_connection, _: set_pragmas(dbapi_connection, pragmas),
+        )
+        if read_only_views:
+            read_only_pragmas = {
+                name: value
+                for name, value in pragmas.items()
+                if name in READ_ONLY_PRAGMAS
+            }
+            sa.event.listen(
+                db.engines["read_only"],
+                "connect",
+                lambda dbapi_connection, _: set_pragmas(
+                    dbapi_connection, read_only_pragmas
+                ),
+            )
+            app.url_value_preprocessor(use_read_only_engine)
+
+
+def read_only(view):
+    """
+    Decorate a view that only reads from the database, so it reads through the
+    read-only engine when READ_ONLY_VIEWS is on
+
+    Parameters:
+        view (function): The view function to decorate
+    """
+
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        return view(*args, **kwargs)
+
+    decorated_view.read_only = True
+    return decorated_view
+
+
+def use_read_only_engine(endpoint, values):
+    """
+    Send the queries of a request to a read-only view to the read-only engine.
+    Runs before the url value preprocessors of blueprints, which query too
+
+    Parameters:
+        endpoint: Endpoint
+        values (dict): All the values route is called with
+    """
+    view = current_app.view_functions.get(endpoint)
+    if getattr(view, "read_only", False):
+        db.session.info["read_only"] = True
+
+
+def can_read(engine):
+    """
+    Check whether a read-only engine can read its database. Reading a WAL
+    database read only fails when its -shm file doesn't exist and can't be
+    created, such as after every connection closed on a read-only mount. Once a
+    read succeeds the engine isn't checked again
+
+    Parameters:
+        engine: The read-only engine
+
+    Returns:
+        readable (bool): Whether the engine can read the database
+    """
+    if engine in _readable_engines:
+        return True
+    try:
+        with engine.connect() as connection:
+            connection.exec_driver_sql("SELECT 1 FROM sqlite_master LIMIT 1")
+    except sa.exc.OperationalError:
+        return False
+    _readable_engines.add(engine)
+    return True
+
+
+def set_pragmas(dbapi_connection, pragmas):
+    """
+    Set pragmas on a new SQLite connection
+
+    Parameters:
+        dbapi_connection: sqlite3 connection
+        pragmas (dict): Pragma names mapped to their values
+    """
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def get_read_only_url(app, url):
+    """
+    Get the url that opens a SQLite file read only
+
+    Parameters:
+        app: Flask app object
+        url: SQLAlchemy URL of the SQLite file
 
-db = SQLAlchemy()
+    Returns:
+        url: SQLAlchemy URL of the same file opened read only
+    """
+    path = url.database
+    if path.startswith("file:"):
+        path = path[len("file:") :]
+    # Relative paths are relative to the instance folder, as in Flask-SQLAlchemy
+    if not os.path.isabs(path):
+        path = os.path.join(app.instance_path, path)
+    return url.set(
+        database=f"file:{path}", query={**url.query, "mode": "ro", "uri": "true"}
+    )
@@ -0,0 +1,257 @@
+"""
+Versioned schema migrations, so databases created by older versions of the app
+can be upgraded in place. The schema version is kept in SQLite's 'user_version'
+pragma, and every migration is safe to run again, since SQLite commits schema
+changes as they're made and a migration can be interrupted partway
+
+Methods:
+    upgrade_db()
+    get_schema_version()
+    set_schema_version(version)
+    add_item_flags(connection)
+    add_synced_comments(connection)
+    add_indexes(connection)
+    add_rank_snapshots(connection)
+    enable_incremental_vacuum(connection)
+    convert_to_incremental_vacuum()
+    add_column(connection, column)
+    migration_lock()
+    db_upgrade_command()
+    add_db_upgrade_command(app)
+
+Variables:
+    MIGRATIONS
+    SEEDED_RANKS
+"""
+
+import fcntl
+from contextlib import contextmanager
+from time import time
+import click
+from flask.cli import with_appcontext
+from .db import db
+from .models import Story, Comment
+
+# Ranks of the top feed rebuilt from order_num, as many as the API lists
+SEEDED_RANKS = 500
+
+
+def add_item_flags(connection):
+    """
+    Add the keyword and dead/deleted flags of stories and comments
+    """
+    for column in ["keywords_pending", "dead", "deleted"]:
+        add_column(connection, Story.__table__.c[column])
+    for column in ["dead", "deleted"]:
+        add_column(connection, Comment.__table__.c[column])
+
+
+def add_synced_comments(connection):
+    """
+    Add the comment count stories' comments were last synced at
+    """
+    add_column(connection, Story.__table__.c.synced_comments)
+
+
+def add_indexes(connection):
+    """
+    Add the indexes of every table that are missing
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+
+def add_rank_snapshots(connection):
+    """
+    Replace the feed_ranks table and the order_num column of stories with rank
+    snapshots, carrying the stored rankings over as the first snapshot. Older
+    databases without feed_ranks have their top feed rebuilt from order_num,
+    highest first, as the homepage ranked it
+    """
+    inspector = db.inspect(connection)
+    has_order_num = "order_num" in [
+        info["name"] for info in inspector.get_columns("stories")
+    ]
+    if "feed_ranks" in inspector.get_table_names():
+        fetched_at = connection.exec_driver_sql(
+            "SELECT max(fetched_at) FROM feed_ranks"
+        ).scalar()
+        if fetched_at is not None:
+            fetch_id = connection.exec_driver_sql(
+                f"INSERT INTO rank_fetches (fetched_at) VALUES ({int(fetched_at)})"
+            ).lastrowid
+            connection.exec_driver_sql(
+                "INSERT INTO rank_snapshots "
+                "(feed, fetch_id, rank, story_id, score, descendants) "
+                f"SELECT feed, {fetch_id}, rank, story_id, score, num_comments "
+                "FROM feed_ranks JOIN stories ON stories.id = feed_ranks.story_id"
+            )
+        connection.exec_driver_sql("DROP TABLE feed_ranks")
+    elif (
+        has_order_num
+        and connection.exec_driver_sql(
+            "SELECT count(*) FROM stories WHERE order_num IS NOT NULL"
+        ).scalar()
+    ):
+        fetch_id = connection.exec_driver_sql(
+            f"INSERT INTO rank_fetches (fetched_at) VALUES ({int(time())})"
+        ).lastrowid
+        connection.exec_driver_sql(
+            "INSERT INTO rank_snapshots "
+            "(feed, fetch_id, rank, story_id, score, descendants) "
+            f"SELECT 'top', {fetch_id}, "
+            "row_number() OVER (ORDER BY order_num DESC, id DESC), "
+            "id, score, num_comments FROM stories WHERE order_num IS NOT NULL "
+            f"ORDER BY order_num DESC, id DESC LIMIT {SEEDED_RANKS}"
+        )
+    if has_order_num:
+        connection.exec_driver_sql("ALTER TABLE stories DROP COLUMN order_num")
+
+
+def enable_incremental_vacuum(connection):
+    """
+    Ask for incremental auto vacuum. An existing database only switches when
+    it's rebuilt by convert_to_incremental_vacuum(), which is too slow to run
+    while workers boot, so it's left to 'flask db-upgrade'
+    """
+    connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+
+
+# Applied in order, a database at version N has had the first N applied
+MIGRATIONS = [
+    add_item_flags,
+    add_synced_comments,
+    add_indexes,
+    add_rank_snapshots,
+    enable_incremental_vacuum,
+]
+
+
+def upgrade_db():
+    """
+    Create missing tables and apply the migrations newer than the database's
+    schema version. A new database is created at the latest version
+
+    Returns:
+        applied (list): Names of the migrations applied
+    """
+    with migration_lock():
+        new = not db.inspect(db.engine).get_table_names()
+        db.create_all()
+        if new:
+            set_schema_version(len(MIGRATIONS))
+            return []
+
+        applied = []
+        version = get_schema_version()
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            with db.engine.begin() as connection:
+                migration(connection)
+            set_schema_version(number)
+            applied.append(migration.__name__)
+        return applied
+
+
+def convert_to_incremental_vacuum():
+    """
+    Rebuild the database with a full VACUUM if it doesn't use incremental auto
+    vacuum yet. The rebuild holds an exclusive lock on the whole file for as
+    long as it takes to copy it, so it's only run offline, from the CLI
+
+    Returns:
+        A bool of whether the database was rebuilt
+    """
+    with db.engine.connect() as connection:
+        # 2 is INCREMENTAL, the pending setting only shows after the rebuild
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return False
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+    return True
+
+
+def get_schema_version():
+    """
+    Get the schema version of the database
+
+    Returns:
+        version (int): Number of migrations applied to the database
+    """
+    with db.engine.connect() as connection:
+        return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def set_schema_version(version):
+    """
+    Set the schema version of the database
+
+    Parameters:
+        version (int): Number of migrations applied to the database
+    """
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql(f"PRAGMA user_version = {version}")
+
+
+def add_column(connection, column):
+    """
+    Add a model's column to its table if the table doesn't have it yet. Rows
+    already in the table get the column's default
+
+    Parameters:
+        connection: SQLAlchemy connection to the database
+        column: The Column object of a model
+    """
+    table = column.table.name
+    existing = [info["name"] for info in db.inspect(connection).get_columns(table)]
+    if column.name in existing:
+        return
+
+    column_type = column.type.compile(dialect=connection.dialect)
+    sql = f"ALTER TABLE {table} ADD COLUMN {column.name} {column_type}"
+    if column.default is not None and column.default.is_scalar:
+        sql += f" DEFAULT {int(column.default.arg)}"
+    connection.exec_driver_sql(sql)
+
+
+@contextmanager
+def migration_lock():
+    """
+    Hold a lock file next to the database file for the block inside the 'with'
+    statement, so worker processes starting together don't migrate the
+    database at the same time
+    """
+    database = db.engine.url.database
+    if not database or database == ":memory:":
+        # Nothing else can open an in memory database
+        yield
+        return
+    with open(f"{database}.migration.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@click.command("db-upgrade")
+@with_appcontext
+def db_upgrade_command():
+    """
+    Function called from CLI command "Flask db-upgrade"
+    """
+    for name in upgrade_db():
+        click.echo(f"* Applied {name} *")
+    if convert_to_incremental_vacuum():
+        click.echo("* Rebuilt the database for incremental vacuum *")
+    click.echo(f"* Schema version {get_schema_version()} *")
+
+
+def add_db_upgrade_command(app):
+    """
+    Called in app.py to add command to flask
+
+    Parameters:
+        app: Flask app object
+    """
+    app.cli.add_command(db_upgrade_command)
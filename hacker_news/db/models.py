@@ -5,6 +5,9 @@ Defines all models for SQLAlchemy and the database
 from flask_login import UserMixin
 from . import db
 
+# Keeps 'IN (...)' queries under SQLite's limit on bound parameters
+MAX_QUERY_IDS = 500
+
 
 class SearchMixin:
     """
@@ -12,6 +15,8 @@ class SearchMixin:
 
     Methods:
         find_item(cls, id): Find item in database and return it
+        find_items(cls, ids): Find many items in database and return them by ID
+        find_existing_ids(cls, ids): Find which IDs are in the database
         get_all(cls): Get all of item from database and return them
     """
 
@@ -20,6 +25,29 @@ class SearchMixin:
         item = db.session.scalars(db.select(cls).filter_by(id=id)).one_or_none()
         return item
 
+    @classmethod
+    def find_items(cls, ids):
+        ids = list(set(ids))
+        items = {}
+        for i in range(0, len(ids), MAX_QUERY_IDS):
+            for item in db.session.scalars(
+                db.select(cls).filter(cls.id.in_(ids[i : i + MAX_QUERY_IDS]))
+            ):
+                items[item.id] = item
+        return items
+
+    @classmethod
+    def find_existing_ids(cls, ids):
+        ids = list(set(ids))
+        existing_ids = set()
+        for i in range(0, len(ids), MAX_QUERY_IDS):
+            existing_ids.update(
+                db.session.scalars(
+                    db.select(cls.id).filter(cls.id.in_(ids[i : i + MAX_QUERY_IDS]))
+                )
+            )
+        return existing_ids
+
     @classmethod
     def get_all(cls):
         items = db.session.scalars(db.select(cls)).all()
@@ -85,8 +113,8 @@ class User(UserMixin, SearchMixin, db.Model):
     def has_liked_story(self, story_id):
         story = db.session.scalars(
             db.select(StoryAssociation).filter(
-                StoryAssociation.user_id.like(self.id),
-                StoryAssociation.story_id.like(story_id),
+                StoryAssociation.user_id == self.id,
+                StoryAssociation.story_id == story_id,
             )
         ).one_or_none()
         return story
@@ -104,12 +132,20 @@ class Story(SearchMixin, db.Model):
         author: Story author
         url: Story url
         num_comments: Number of comments a Story has
-        order_num: The order of the story when fetched
+        synced_comments: Number of comments when the story's comments were
+            last synced
         keywords: Story keywords
+        keywords_pending: If the story's keywords haven't been extracted yet
+        dead: If the story is flagged dead
+        deleted: If the story was deleted
         comments: Story comments
     """
 
     __tablename__ = "stories"
+    __table_args__ = (
+        # Keyword extraction polls for pending stories after every refresh
+        db.Index("ix_stories_keywords_pending", "keywords_pending"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String)
@@ -118,8 +154,11 @@ class Story(SearchMixin, db.Model):
     author = db.Column(db.String)
     url = db.Column(db.String)
     num_comments = db.Column(db.Integer)
-    order_num = db.Column(db.Integer)
+    synced_comments = db.Column(db.Integer)
     keywords = db.Column(db.String)
+    keywords_pending = db.Column(db.Boolean, default=False)
+    dead = db.Column(db.Boolean, default=False)
+    deleted = db.Column(db.Boolean, default=False)
     comments = db.relationship(
         "Comment", cascade="all, delete, delete-orphan", backref="story"
     )
@@ -128,6 +167,93 @@ class Story(SearchMixin, db.Model):
         return f"<ID {self.id}> {self.title}"
 
 
+class RankFetch(db.Model):
+    """
+    The RankFetch class that models the rank_fetches table, one row for every
+    refresh that saved the feeds' rankings
+
+    Attributes:
+        id: Fetch ID, increasing with every refresh
+        fetched_at: Time the feeds were fetched in Unix time
+    """
+
+    __tablename__ = "rank_fetches"
+
+    id = db.Column(db.Integer, primary_key=True)
+    fetched_at = db.Column(db.Integer, index=True)
+
+    def __repr__(self):
+        return f"<RankFetch {self.id}> {self.fetched_at}"
+
+
+class RankSnapshot(db.Model):
+    """
+    The RankSnapshot class that models the rank_snapshots table, holding the
+    ranking of every feed at every refresh. Rows are only ever added, and
+    pruned once they're older than the retention period
+
+    Attributes:
+        feed: Feed the ranking belongs to, such as 'top' or 'ask'
+        fetch_id: The refresh the ranking was fetched by
+        rank: Position of the story in the feed, starting at 1
+        story_id: Story ID
+        score: Score of the story at the time
+        descendants: Number of comments of the story at the time
+        story: Story object
+    """
+
+    __tablename__ = "rank_snapshots"
+
+    # The primary key orders rows by feed then fetch, so the latest ranking of a
+    # feed is a single range of the index
+    feed = db.Column(db.String, primary_key=True)
+    fetch_id = db.Column(db.Integer, db.ForeignKey("rank_fetches.id"), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    story_id = db.Column(db.Integer, db.ForeignKey("stories.id"), index=True)
+    score = db.Column(db.Integer)
+    descendants = db.Column(db.Integer)
+    story = db.relationship("Story")
+
+    def __repr__(self):
+        return f"<{self.feed} #{self.rank} of {self.fetch_id}> {self.story_id}"
+
+
+class RefreshJob(SearchMixin, db.Model):
+    """
+    The RefreshJob class that models the refresh_jobs table, a refresh from
+    the Hacker News API run in the background
+
+    Attributes:
+        id: Job ID
+        kind: 'stories', or 'comments' if the refresh includes comments
+        status: 'queued', 'running', 'succeeded' or 'failed'
+        active_kind: The kind while the job is queued or running, None after.
+            Unique, so only one job of each kind is ever in flight
+        submitted_at: Time the job was submitted in Unix time
+        started_at: Time the job started running in Unix time
+        finished_at: Time the job finished in Unix time
+        items_queried: Number of items requested from the API so far
+        items_failed: Number of items that couldn't be fetched so far
+        error: Why the job failed
+    """
+
+    __tablename__ = "refresh_jobs"
+
+    id = db.Column(db.String, primary_key=True)
+    kind = db.Column(db.String)
+    status = db.Column(db.String, default="queued")
+    active_kind = db.Column(db.String, unique=True)
+    submitted_at = db.Column(db.Float, index=True)
+    started_at = db.Column(db.Float)
+    finished_at = db.Column(db.Float, index=True)
+    items_queried = db.Column(db.Integer, default=0)
+    items_failed = db.Column(db.Integer, default=0)
+    error = db.Column(db.String)
+
+    def __repr__(self):
+        return f"<RefreshJob {self.id}> {self.kind} {self.status}"
+
+
 # For like/dislike functionality
 class StoryAssociation(db.Model):
     """
@@ -145,6 +271,11 @@ class StoryAssociation(db.Model):
     """
 
     __tablename__ = "story_association_table"
+    # Lookups by (user_id, story_id) use the primary key
+    __table_args__ = (
+        db.Index("ix_story_association_story_id", "story_id"),
+        db.Index("ix_story_association_type_story_id", "type", "story_id"),
+    )
 
     user_id = db.Column(db.ForeignKey("user.id"), primary_key=True)
     story_id = db.Column(db.ForeignKey("stories.id"), primary_key=True)
@@ -177,10 +308,17 @@ class Comment(SearchMixin, db.Model):
         type: A root or child comment
         story_id: Story comment belongs to if root
         parent_comment_id: Comment the comment belongs to if child
+        dead: If the comment is flagged dead
+        deleted: If the comment was deleted
         comments: Comment comments
     """
 
     __tablename__ = "comments"
+    __table_args__ = (
+        # Root comments are loaded by story, their replies by parent
+        db.Index("ix_comments_story_id_type", "story_id", "type"),
+        db.Index("ix_comments_parent_comment_id", "parent_comment_id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     time = db.Column(db.Integer)
@@ -189,6 +327,8 @@ class Comment(SearchMixin, db.Model):
     type = db.Column(db.String)
     story_id = db.Column(db.Integer, db.ForeignKey("stories.id"))
     parent_comment_id = db.Column(db.Integer, db.ForeignKey("comments.id"))
+    dead = db.Column(db.Boolean, default=False)
+    deleted = db.Column(db.Boolean, default=False)
     comments = db.relationship(
         "Comment", backref=db.backref("parent_comment", remote_side="Comment.id")
     )
@@ -0,0 +1,123 @@
+"""
+Bulk insert or update of Hacker News items using SQLite's
+'INSERT ... ON CONFLICT DO UPDATE'. Rows are written with executemany in large
+batches inside a single transaction, so ingestion holds the write lock briefly
+
+Methods:
+    upsert_stories(rows, update)
+    upsert_comments(rows, update)
+    upsert_rows(model, rows, update_columns, update, keep_columns)
+
+Variables:
+    UPSERT_BATCH_SIZE
+    STORY_UPDATE_COLUMNS
+    COMMENT_UPDATE_COLUMNS
+    STORY_KEEP_COLUMNS
+    COMMENT_KEEP_COLUMNS
+"""
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .db import db
+from .models import Story, Comment
+
+UPSERT_BATCH_SIZE = 1000
+# Columns that are refreshed when an item is already in the database
+STORY_UPDATE_COLUMNS = (
+    "title",
+    "score",
+    "url",
+    "num_comments",
+    "dead",
+    "deleted",
+)
+COMMENT_UPDATE_COLUMNS = ("author", "text", "dead", "deleted")
+# Content the API leaves out of dead and deleted items, which keeps its stored
+# value when an update has none
+STORY_KEEP_COLUMNS = ("title", "score", "url")
+COMMENT_KEEP_COLUMNS = ("author", "text")
+
+
+def upsert_stories(rows, update=True):
+    """
+    Insert stories into the database, updating the ones that already exist
+
+    Parameters:
+        rows (list): A list of dicts with a value for every Story column written
+        update (bool): Whether to update existing stories or leave them as is
+
+    Returns:
+        counts (dict): Number of rows 'inserted' and 'updated'
+    """
+    return upsert_rows(
+        Story,
+        rows,
+        update_columns=STORY_UPDATE_COLUMNS,
+        update=update,
+        keep_columns=STORY_KEEP_COLUMNS,
+    )
+
+
+def upsert_comments(rows, update=True):
+    """
+    Insert comments into the database, updating the ones that already exist
+
+    Parameters:
+        rows (list): A list of dicts with a value for every Comment column written
+        update (bool): Whether to update existing comments or leave them as is
+
+    Returns:
+        counts (dict): Number of rows 'inserted' and 'updated'
+    """
+    return upsert_rows(
+        Comment,
+        rows,
+        update_columns=COMMENT_UPDATE_COLUMNS,
+        update=update,
+        keep_columns=COMMENT_KEEP_COLUMNS,
+    )
+
+
+def upsert_rows(model, rows, update_columns, update=True, keep_columns=()):
+    """
+    Insert rows of a model in batches with executemany. The caller commits, so
+    every batch is part of the same transaction
+
+    Parameters:
+        model (Model): The model of the table to write to
+        rows (list): A list of dicts that all have the same keys
+        update_columns (tuple): Columns to overwrite when a row already exists
+        update (bool): Whether to update existing rows or leave them as is
+        keep_columns (tuple): Update columns that keep their stored value when
+            the new one is NULL or empty
+
+    Returns:
+        counts (dict): Number of rows 'inserted' and 'updated'
+    """
+    if not rows:
+        return {"inserted": 0, "updated": 0}
+
+    # Rows that already exist are updated, or skipped when update is off
+    existing_ids = model.find_existing_ids([row["id"] for row in rows])
+    new_ids = {row["id"] for row in rows} - existing_ids
+
+    statement = sqlite_insert(model.__table__)
+    if update:
+        statement = statement.on_conflict_do_update(
+            index_elements=[model.id],
+            set_={
+                column: db.func.coalesce(
+                    db.func.nullif(statement.excluded[column], ""),
+                    model.__table__.c[column],
+                )
+                if column in keep_columns
+                else statement.excluded[column]
+                for column in update_columns
+                if column in rows[0]
+            },
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=[model.id])
+
+    for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+        db.session.execute(statement, rows[i : i + UPSERT_BATCH_SIZE])
+    return {"inserted": len(new_ids), "updated": len(existing_ids) if update else 0}
@@ -101,12 +101,38 @@ const unhover_dislike = (element) => {
     }
 };
 
+/* Poll an update job until it finishes */
+const wait_for_job = async (status_url) => {
+    while (true) {
+        const job = await fetch(status_url).then((res) => res.json());
+        if (job.status === "succeeded" || job.status === "failed") return job;
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+};
+
+/* Update stories in the background and reload once they're updated */
+const refresh_stories = async () => {
+    toggle_refresh();
+    await fetch("/update").then((res) =>
+        res.json().then(async (data) => {
+            await wait_for_job(data.status_url);
+            window.location.reload();
+        })
+    );
+};
+
 /* Update comments */
 const update_comments = async (element) => {
     toggle_refresh();
     await fetch("/update/comments").then((res) =>
-        res.json().then((data) => {
-            display_update_comments_time(data.time_taken);
+        res.json().then(async (data) => {
+            const job = await wait_for_job(data.status_url);
+            /* A job that failed before it started has no duration */
+            if (job.status === "succeeded" && job.duration !== null) {
+                display_update_comments_time(job.duration.toFixed(3));
+            } else if (job.status === "failed") {
+                display_update_comments_error(job.error);
+            }
             toggle_refresh();
         })
     );
@@ -119,6 +145,21 @@ const display_update_comments_time = (time) => {
         "update_comments_time_block"
     );
 
+    document.getElementById("update_comments_error_block").style.display =
+        "none";
     update_comments_time_block.style.display = "";
     update_comments_time.textContent = time;
 };
+
+/* Display why updating comments failed */
+const display_update_comments_error = (error) => {
+    update_comments_error = document.getElementById("update_comments_error");
+    update_comments_error_block = document.getElementById(
+        "update_comments_error_block"
+    );
+
+    document.getElementById("update_comments_time_block").style.display =
+        "none";
+    update_comments_error_block.style.display = "";
+    update_comments_error.textContent = error || "";
+};
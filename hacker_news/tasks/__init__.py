@@ -2,27 +2,128 @@
 Creates tasks to run at different time intervals during the lifetime of a Flask
 application.
 
+Tasks that refresh shared data only run on the worker elected leader, the
+rest run on every worker. With SCHEDULE_MODE set to 'adaptive' the interval of
+refreshes follows how fast the front page moves, and hot stories are refreshed
+between them. Stories past retention are archived hourly.
+
 Methods:
+    elect_scheduler_leader()
     get_new_api_data()
+    refresh_hot_stories()
+    reschedule_refresh()
+    apply_retention()
+    unload_idle_keyword_model()
 
 Variables:
     scheduler
+    leader_election
 """
 
-import asyncio
-from time import time
 from flask_apscheduler import APScheduler
-from ..utilities import update_data
+from ..utilities import (
+    submit_refresh,
+    get_refresh_interval,
+    refresh_fits_budget,
+    metrics_registry,
+    keyword_extractor,
+    shutdown_idle_keyword_pool,
+    DEFAULT_IDLE_TIMEOUT,
+)
+from .leader import leader_election
 
 scheduler = APScheduler()
 
 
+@scheduler.task("interval", id="elect_scheduler_leader", seconds=15)
+def elect_scheduler_leader():
+    """
+    Takes over as leader if no worker is, such as after the leader died, and
+    reports this worker's leadership in the metrics
+    """
+    leader_election.try_acquire()
+    leader_election.record_metrics()
+
+
 @scheduler.task("interval", id="get_new_api_data", seconds=300, misfire_grace_time=900)
 def get_new_api_data():
     """
-    Calls update_data() function to update data
+    Submits a refresh job to update data, joining the one already running if a
+    user started it. Comments are refreshed too when REFRESH_COMMENTS is on.
+    Only runs on the leader. With adaptive scheduling, refreshes that would go
+    over the API request budget are skipped
+    """
+    if not leader_election.is_leader:
+        return
+    with scheduler.app.app_context():
+        comments = scheduler.app.config.get("REFRESH_COMMENTS", False)
+        # The next interval is measured by the refresh, so it's applied once
+        # the refresh finishes
+        adaptive = scheduler.app.config.get("SCHEDULE_MODE") == "adaptive"
+        if adaptive and not refresh_fits_budget():
+            metrics_registry.inc("hn_scheduled_refreshes_total", result="skipped")
+            metrics_registry.flush()
+            print("Skipped refresh, it would go over the API request budget")
+            return
+        job, joined = submit_refresh(
+            kind="comments" if comments else "stories",
+            on_finished=reschedule_refresh if adaptive else None,
+        )
+        if joined:
+            print(f"Refresh job {job.id} already running")
+
+
+@scheduler.task("interval", id="refresh_hot_stories", seconds=60)
+def refresh_hot_stories():
+    """
+    Submits a refresh of the stories the last refresh found hot. Only runs on
+    the leader with adaptive scheduling
+    """
+    if not leader_election.is_leader:
+        return
+    if scheduler.app.config.get("SCHEDULE_MODE") != "adaptive":
+        return
+    with scheduler.app.app_context():
+        submit_refresh(kind="hot")
+
+
+def reschedule_refresh():
+    """
+    Moves the get_new_api_data task to the interval set by the last refresh's
+    measurement of the front page. Called when a scheduled refresh finishes
+    """
+    with scheduler.app.app_context():
+        interval = round(get_refresh_interval())
+    job = scheduler.get_job("get_new_api_data")
+    if job and job.trigger.interval.total_seconds() != interval:
+        scheduler.scheduler.reschedule_job(
+            "get_new_api_data", trigger="interval", seconds=interval
+        )
+        print(f"Refreshing every {interval} seconds")
+
+
+@scheduler.task("interval", id="apply_retention", seconds=3600)
+def apply_retention():
+    """
+    Submits a job archiving and deleting the stories past retention. Only runs
+    on the leader
     """
+    if not leader_election.is_leader:
+        return
     with scheduler.app.app_context():
-        start = time()
-        asyncio.run(update_data())
-        print(f"Updated data from API in {round(time() - start, 3)} seconds")
+        submit_refresh(kind="retention")
+
+
+@scheduler.task("interval", id="unload_idle_keyword_model", seconds=60)
+def unload_idle_keyword_model():
+    """
+    Releases the keyword model's memory and stops the keyword worker processes
+    when they haven't been used for KEYWORD_MODEL_IDLE_TIMEOUT seconds
+    """
+    if max_idle := scheduler.app.config.get(
+        "KEYWORD_MODEL_IDLE_TIMEOUT", DEFAULT_IDLE_TIMEOUT
+    ):
+        if keyword_extractor.unload_if_idle(max_idle):
+            print("Unloaded idle keyword model")
+        if shutdown_idle_keyword_pool(max_idle):
+            print("Stopped idle keyword workers")
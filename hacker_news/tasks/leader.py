@@ -0,0 +1,101 @@
+"""
+Leader election between worker processes. Every gunicorn worker runs the
+scheduler, but only the worker holding an exclusive lock on a shared file runs
+the tasks that touch shared state. The operating system releases the lock when
+its holder dies, and the next worker to retry takes over
+
+Classes:
+    LeaderElection
+
+Variables:
+    DEFAULT_LOCK_PATH
+    leader_election
+"""
+
+import fcntl
+import os
+from time import time
+from ..utilities import metrics_registry
+
+DEFAULT_LOCK_PATH = "hacker_news/db/scheduler.lock"
+
+
+class LeaderElection:
+    """
+    A leadership lease held through a non-blocking file lock
+
+    Attributes:
+        path: Path of the lock file every worker competes for
+        is_leader: Whether this process holds the lock
+
+    Methods:
+        init_app(self, app): Configure the election from a Flask app
+        try_acquire(self): Become the leader if no other process is
+        release(self): Give up leadership
+        record_metrics(self): Report this worker's leadership in the metrics
+    """
+
+    def __init__(self, path=DEFAULT_LOCK_PATH):
+        self.path = path
+        self._lock_file = None
+        self._pid = None
+
+    @property
+    def is_leader(self):
+        # A forked child shares the parent's lock but isn't the leader
+        return self._lock_file is not None and self._pid == os.getpid()
+
+    def init_app(self, app):
+        """
+        Configure the election from a Flask app
+
+        Parameters:
+            app: Flask app object
+        """
+        self.path = app.config.get("SCHEDULER_LOCK_PATH", self.path)
+
+    def try_acquire(self):
+        """
+        Become the leader if no other process is
+
+        Returns:
+            A bool of whether this process is the leader
+        """
+        if self.is_leader:
+            return True
+
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self._lock_file, self._pid = lock_file, os.getpid()
+        metrics_registry.inc("hn_scheduler_leader_changes_total")
+        print(f"Worker {self._pid} is now the scheduler leader")
+        return True
+
+    def release(self):
+        """
+        Give up leadership so another worker can take over
+        """
+        if self.is_leader:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+        self._lock_file = self._pid = None
+
+    def record_metrics(self):
+        """
+        Report whether this worker is the leader, with a heartbeat so series of
+        workers that died can be told apart, and flush the metrics
+        """
+        pid = os.getpid()
+        metrics_registry.set("hn_scheduler_leader", int(self.is_leader), pid=pid)
+        metrics_registry.set(
+            "hn_scheduler_heartbeat_timestamp_seconds", time(), pid=pid
+        )
+        metrics_registry.flush()
+
+
+leader_election = LeaderElection()
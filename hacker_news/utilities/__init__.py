@@ -8,4 +8,18 @@ from .login_manager import (
     init_oauth,
     admin_required,
 )
+from .item_cache import item_cache
+from .metrics import metrics_registry
+from .keyword_cache import keyword_cache
+from .keywords import (
+    keyword_extractor,
+    start_keyword_extraction,
+    extract_pending_keywords,
+    shutdown_idle_keyword_pool,
+    DEFAULT_IDLE_TIMEOUT,
+)
 from .news_api import *
+from .refresh_jobs import submit_refresh, get_refresh_job, serialize_refresh_job
+from .adaptive_schedule import get_refresh_interval, refresh_fits_budget
+from .retention import add_retention_command
+from .benchmark import add_benchmark_commands
@@ -0,0 +1,301 @@
+"""
+Adaptive refresh scheduling. After every refresh the top of the front page is
+compared with its rank snapshot from the previous refresh, and how fast its ranks
+churn and its scores grow decides how soon the next refresh runs. Stories at
+the top ranks or gaining comments quickly are marked hot and refreshed on their
+own between full refreshes. Every refresh stays within an hourly budget of API
+requests
+
+Methods:
+    record_activity()
+    get_top_snapshots()
+    compute_refresh_interval(churn, velocity, current)
+    get_refresh_interval()
+    refresh_fits_budget()
+    get_hot_story_ids()
+    refresh_hot_stories()
+    get_requests_last_hour()
+    get_average_refresh_cost()
+    load_setting(key)
+    save_setting(key, value)
+
+Variables:
+    ACTIVITY_RANKS
+    DEFAULT_REFRESH_INTERVAL
+    DEFAULT_MIN_INTERVAL
+    DEFAULT_MAX_INTERVAL
+    DEFAULT_TARGET_CHURN
+    DEFAULT_TARGET_VELOCITY
+    DEFAULT_HOT_RANKS
+    DEFAULT_HOT_COMMENT_VELOCITY
+    DEFAULT_REQUEST_BUDGET
+"""
+
+import json
+from time import time
+from flask import current_app
+from ..db import db, RankFetch, RankSnapshot, RefreshJob, WebsiteSetting
+from . import news_api
+from .hn_client import close_client
+from .item_cache import item_cache
+from .metrics import metrics_registry
+
+# Ranks of the top feed compared between refreshes
+ACTIVITY_RANKS = 30
+DEFAULT_REFRESH_INTERVAL = 300
+DEFAULT_MIN_INTERVAL = 60
+# Longer intervals would outlive the delta sync checkpoint
+DEFAULT_MAX_INTERVAL = news_api.DELTA_SYNC_MAX_AGE
+# Share of the compared ranks that change hands between refreshes, and points
+# gained per minute by the compared stories, that keep the base interval
+DEFAULT_TARGET_CHURN = 0.2
+DEFAULT_TARGET_VELOCITY = 50
+DEFAULT_HOT_RANKS = 10
+# Comments per minute that make a story hot wherever it ranks
+DEFAULT_HOT_COMMENT_VELOCITY = 1
+# API requests per hour shared by full and hot refreshes
+DEFAULT_REQUEST_BUDGET = 30000
+
+
+def record_activity():
+    """
+    Measure how much the top feed changed between its two latest rank
+    snapshots, then save the next refresh interval and the hot stories. Called
+    after every refresh that fetched the feeds
+    """
+    config = current_app.config
+    snapshots = get_top_snapshots()
+    # A partial refresh can leave a snapshot without any of the compared ranks
+    if len(snapshots) < 2 or not all(stories for _, stories in snapshots):
+        return
+
+    (fetched_at, stories), (previous_fetched_at, previous_stories) = snapshots
+    minutes = max((fetched_at - previous_fetched_at) / 60, 1 / 60)
+    moved = [
+        story_id
+        for story_id, (rank, _, _) in stories.items()
+        if previous_stories.get(story_id, [None])[0] != rank
+    ]
+    churn = len(moved) / len(stories)
+    points, comment_velocity = 0, {}
+    for story_id, (rank, score, descendants) in stories.items():
+        if story_id in previous_stories:
+            _, previous_score, previous_descendants = previous_stories[story_id]
+            points += max(score - previous_score, 0)
+            comment_velocity[story_id] = (descendants - previous_descendants) / minutes
+    velocity = points / minutes
+
+    interval = compute_refresh_interval(churn, velocity, get_refresh_interval())
+    hot_ranks = config.get("HOT_RANKS", DEFAULT_HOT_RANKS)
+    hot_velocity = config.get("HOT_COMMENT_VELOCITY", DEFAULT_HOT_COMMENT_VELOCITY)
+    hot_ids = [
+        story_id
+        for story_id, (rank, _, _) in stories.items()
+        if rank <= hot_ranks or comment_velocity.get(story_id, 0) >= hot_velocity
+    ]
+    save_setting("refresh_interval", interval)
+    save_setting("hot_story_ids", hot_ids)
+
+    metrics_registry.set("hn_schedule_rank_churn", churn)
+    metrics_registry.set("hn_schedule_score_velocity", velocity)
+    metrics_registry.set("hn_schedule_refresh_interval_seconds", interval)
+    metrics_registry.set("hn_schedule_hot_stories", len(hot_ids))
+    metrics_registry.flush()
+
+
+def get_top_snapshots():
+    """
+    Get the top ACTIVITY_RANKS ranks of the two latest rank snapshots of the top
+    feed
+
+    Returns:
+        snapshots (list): Up to two (fetched_at, stories) tuples, newest first,
+            where stories maps story IDs to their (rank, score, descendants)
+    """
+    fetches = db.session.execute(
+        db.select(RankFetch.id, RankFetch.fetched_at)
+        .filter(
+            RankFetch.id.in_(
+                db.select(RankSnapshot.fetch_id)
+                .filter_by(feed="top")
+                .distinct()
+                .order_by(RankSnapshot.fetch_id.desc())
+                .limit(2)
+            )
+        )
+        .order_by(RankFetch.id.desc())
+    ).all()
+    snapshots = []
+    for fetch_id, fetched_at in fetches:
+        rows = db.session.execute(
+            db.select(
+                RankSnapshot.story_id,
+                RankSnapshot.rank,
+                RankSnapshot.score,
+                RankSnapshot.descendants,
+            ).filter(
+                RankSnapshot.feed == "top",
+                RankSnapshot.fetch_id == fetch_id,
+                RankSnapshot.rank <= ACTIVITY_RANKS,
+            )
+        ).all()
+        stories = {
+            story_id: (rank, score or 0, descendants or 0)
+            for story_id, rank, score, descendants in rows
+        }
+        snapshots.append((fetched_at, stories))
+    return snapshots
+
+
+def compute_refresh_interval(churn, velocity, current):
+    """
+    Compute the interval until the next refresh. A front page moving faster
+    than the targets shortens the base interval and a still one lengthens it,
+    averaged with the current interval so one quiet refresh doesn't swing it
+
+    Parameters:
+        churn (float): Share of the compared ranks that changed
+        velocity (float): Points per minute gained by the compared stories
+        current (float): Seconds between refreshes now
+
+    Returns:
+        interval (float): Seconds until the next refresh
+    """
+    config = current_app.config
+    base = config.get("REFRESH_INTERVAL", DEFAULT_REFRESH_INTERVAL)
+    min_interval = config.get("REFRESH_MIN_INTERVAL", DEFAULT_MIN_INTERVAL)
+    max_interval = config.get("REFRESH_MAX_INTERVAL", DEFAULT_MAX_INTERVAL)
+    budget = config.get("API_REQUEST_BUDGET", DEFAULT_REQUEST_BUDGET)
+
+    activity = max(
+        churn / config.get("REFRESH_TARGET_CHURN", DEFAULT_TARGET_CHURN),
+        velocity / config.get("REFRESH_TARGET_VELOCITY", DEFAULT_TARGET_VELOCITY),
+    )
+    target = base / activity if activity else max_interval
+    interval = max((current + target) / 2, min_interval)
+    # Refreshes that cost more requests than the budget allows run less often,
+    # up to max_interval, past which refresh_fits_budget() skips them instead
+    interval = max(interval, 3600 * get_average_refresh_cost() / budget)
+    return min(interval, max_interval)
+
+
+def get_refresh_interval():
+    """
+    Get the interval until the next refresh set by the last measurement
+
+    Returns:
+        interval (float): Seconds between refreshes
+    """
+    return load_setting("refresh_interval") or current_app.config.get(
+        "REFRESH_INTERVAL", DEFAULT_REFRESH_INTERVAL
+    )
+
+
+def refresh_fits_budget():
+    """
+    Check whether a refresh costing as much as the recent ones would stay
+    within the API request budget of the last hour
+
+    Returns:
+        fits (bool): Whether the refresh fits the budget
+    """
+    budget = current_app.config.get("API_REQUEST_BUDGET", DEFAULT_REQUEST_BUDGET)
+    return get_requests_last_hour() + get_average_refresh_cost() <= budget
+
+
+def get_hot_story_ids():
+    """
+    Get the stories marked hot by the last measurement
+
+    Returns:
+        story_ids (list): IDs of the hot stories
+    """
+    return load_setting("hot_story_ids") or []
+
+
+async def refresh_hot_stories():
+    """
+    Refetch the hot stories from Hacker News API, skipping the refresh when it
+    would go over the API request budget
+
+    Returns:
+        count (int): Number of stories refreshed
+    """
+    story_ids = get_hot_story_ids()
+    budget = current_app.config.get("API_REQUEST_BUDGET", DEFAULT_REQUEST_BUDGET)
+    if not story_ids or get_requests_last_hour() + len(story_ids) > budget:
+        metrics_registry.inc("hn_hot_refreshes_total", result="skipped")
+        return 0
+
+    try:
+        # The cached copies are what a hot refresh is meant to replace
+        item_cache.invalidate(story_ids)
+        stories = await news_api.get_items(story_ids)
+        news_api.insert_stories_db(stories, update=True)
+    finally:
+        await close_client()
+    metrics_registry.inc("hn_hot_refreshes_total", result="refreshed")
+    return len(stories)
+
+
+def get_requests_last_hour():
+    """
+    Count the item requests refresh jobs sent in the last hour
+
+    Returns:
+        count (int): Number of requests
+    """
+    return (
+        db.session.scalar(
+            db.select(db.func.sum(RefreshJob.items_queried)).filter(
+                db.func.coalesce(RefreshJob.finished_at, time()) > time() - 3600
+            )
+        )
+        or 0
+    )
+
+
+def get_average_refresh_cost():
+    """
+    Get the average number of item requests of the recent full or delta
+    refreshes
+
+    Returns:
+        cost (float): Average number of requests, 0 with no finished refresh
+    """
+    costs = db.session.scalars(
+        db.select(RefreshJob.items_queried)
+        .filter(
+            RefreshJob.kind.in_(["stories", "comments"]),
+            RefreshJob.status == "succeeded",
+        )
+        .order_by(RefreshJob.finished_at.desc())
+        .limit(10)
+    ).all()
+    return sum(costs) / len(costs) if costs else 0
+
+
+def load_setting(key):
+    """
+    Load a JSON value saved in the website settings
+
+    Parameters:
+        key (string): Key of the setting
+
+    Returns:
+        value: The saved value, or None if it isn't set
+    """
+    setting = WebsiteSetting.find_item(key)
+    return json.loads(setting.status) if setting and setting.status else None
+
+
+def save_setting(key, value):
+    """
+    Save a JSON value in the website settings
+
+    Parameters:
+        key (string): Key of the setting
+        value: A JSON serializable value
+    """
+    db.session.merge(WebsiteSetting(id=key, status=json.dumps(value)))
+    db.session.commit()
@@ -0,0 +1,224 @@
+"""
+Commands for running the Hacker News API replay server, recording fixtures
+from the real API, and benchmarking a full ingestion run against the replay
+server with a throwaway database
+
+Methods:
+    replay_server_command(...)
+    record_fixtures_command(path, count)
+    benchmark_ingest_command(...)
+    run_benchmark(fixtures, comments, keywords, latency, latency_jitter, error_rate)
+    load_fixtures(path, stories, depth, fanout, seed)
+    add_benchmark_commands(app)
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+from time import time
+import click
+from flask.cli import with_appcontext
+from . import news_api
+from .item_cache import item_cache
+from .keywords import extract_pending_keywords
+from .replay_server import ReplayServer, make_synthetic_fixtures, record_fixtures
+
+# Options shared by the commands that serve fixtures
+fixture_options = [
+    click.option("--fixtures", "path", help="Recorded fixtures JSON file"),
+    click.option("--stories", default=20, help="Synthetic stories per feed"),
+    click.option("--depth", default=3, help="Synthetic comment tree depth"),
+    click.option("--fanout", default=4, help="Most replies per synthetic item"),
+    click.option("--seed", default=0, help="Seed for synthetic fixtures"),
+    click.option("--latency", default=0.0, help="Mean response delay in seconds"),
+    click.option("--jitter", default=0.0, help="Response delay deviation in seconds"),
+    click.option("--error-rate", default=0.0, help="Fraction of item requests failed"),
+]
+
+
+def add_fixture_options(command):
+    for option in reversed(fixture_options):
+        command = option(command)
+    return command
+
+
+def load_fixtures(path=None, stories=20, depth=3, fanout=4, seed=0):
+    """
+    Load recorded fixtures, or generate synthetic ones when no path is given
+
+    Parameters:
+        path (string): Recorded fixtures JSON file
+        stories (int): Synthetic stories per feed
+        depth (int): Synthetic comment tree depth
+        fanout (int): Most replies per synthetic item
+        seed (int): Seed for synthetic fixtures
+
+    Returns:
+        fixtures (dict): Fixtures for ReplayServer
+    """
+    if path:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    return make_synthetic_fixtures(
+        stories=stories, depth=depth, fanout=fanout, seed=seed
+    )
+
+
+@click.command("replay-server")
+@add_fixture_options
+@click.option("--port", default=8765, help="Port to listen on")
+def replay_server_command(
+    path, stories, depth, fanout, seed, latency, jitter, error_rate, port
+):
+    """
+    Function called from CLI command "Flask replay-server". Serves fixtures
+    until interrupted, set HN_API_URL to http://127.0.0.1:<port>/v0 to use it
+    """
+    fixtures = load_fixtures(path, stories, depth, fanout, seed)
+    server = ReplayServer(
+        fixtures,
+        latency=latency,
+        latency_jitter=jitter,
+        error_rate=error_rate,
+        port=port,
+    )
+    click.echo(f"** Serving {len(fixtures['items'])} items at {server.url} **")
+    server.serve_forever()
+
+
+@click.command("record-fixtures")
+@click.argument("path")
+@click.option("--count", default=30, help="Stories to record from each feed")
+@with_appcontext
+def record_fixtures_command(path, count):
+    """
+    Function called from CLI command "Flask record-fixtures". Records stories
+    and comment trees from the Hacker News API for the replay server
+
+    Parameters:
+        path (string): File to write the fixtures to
+        count (int): Stories to record from each feed
+    """
+    fixtures = asyncio.run(record_fixtures(path, count))
+    click.echo(f"* Recorded {len(fixtures['items'])} items to {path} *")
+
+
+@click.command("benchmark-ingest")
+@add_fixture_options
+@click.option("--comments/--no-comments", default=True, help="Ingest comments")
+@click.option("--keywords", is_flag=True, help="Include keyword extraction")
+def benchmark_ingest_command(
+    path, stories, depth, fanout, seed, latency, jitter, error_rate, comments, keywords
+):
+    """
+    Function called from CLI command "Flask benchmark-ingest". Runs create_data()
+    against the replay server with a temporary database and reports throughput
+    """
+    fixtures = load_fixtures(path, stories, depth, fanout, seed)
+    results = run_benchmark(
+        fixtures,
+        comments=comments,
+        keywords=keywords,
+        latency=latency,
+        latency_jitter=jitter,
+        error_rate=error_rate,
+    )
+    click.echo(f"* {results['items']} items queried, {results['failed']} failed *")
+    click.echo(f"* Wall time {results['wall_time']:.3f} seconds *")
+    click.echo(f"* {results['items_per_second']:.1f} items/sec *")
+    click.echo(f"* DB write time {results['db_write_time']:.3f} seconds *")
+    if keywords:
+        click.echo(f"* Keyword time {results['keyword_time']:.3f} seconds *")
+
+
+def run_benchmark(
+    fixtures,
+    comments=True,
+    keywords=False,
+    latency=0.0,
+    latency_jitter=0.0,
+    error_rate=0.0,
+):
+    """
+    Run create_data() against a replay server in this process, writing into a
+    temporary database with the scheduler disabled
+
+    Parameters:
+        fixtures (dict): Fixtures for ReplayServer
+        comments (bool): Determines whether to ingest comments
+        keywords (bool): Determines whether to extract keywords after ingesting
+        latency (float): Mean response delay in seconds
+        latency_jitter (float): Response delay deviation in seconds
+        error_rate (float): Fraction of item requests failed
+
+    Returns:
+        results (dict): Items queried and failed, wall time, items/sec, DB write
+            time and keyword time
+    """
+    # Imported here since the app factory imports this module
+    from .. import create_app
+
+    server = ReplayServer(
+        fixtures,
+        latency=latency,
+        latency_jitter=latency_jitter,
+        error_rate=error_rate,
+    )
+    url = server.start()
+    max_story_count = news_api.MAX_STORY_COUNT
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app(
+                {
+                    "SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                    + os.path.join(directory, "benchmark.db"),
+                    "KEYWORD_CACHE_PATH": os.path.join(directory, "keyword_cache.db"),
+                    "METRICS_PATH": os.path.join(directory, "metrics.db"),
+                    "KEYWORD_EXTRACTION": False,
+                    "SCHEDULER_ENABLED": False,
+                    "HN_API_URL": url,
+                }
+            )
+            with app.app_context():
+                item_cache.clear()
+                news_api.MAX_STORY_COUNT = len(fixtures["feeds"]["topstories"])
+                queried = news_api.IDS_QUERIED
+                failed = news_api.IDS_FAILED
+                write_time = news_api.DB_WRITE_TIME
+
+                start = time()
+                asyncio.run(news_api.create_data(comments=comments))
+                wall_time = time() - start
+
+                keyword_time = 0.0
+                if keywords:
+                    start = time()
+                    extract_pending_keywords()
+                    keyword_time = time() - start
+                news_api.db.session.remove()
+    finally:
+        news_api.MAX_STORY_COUNT = max_story_count
+        server.stop()
+
+    items = news_api.IDS_QUERIED - queried
+    return {
+        "items": items,
+        "failed": news_api.IDS_FAILED - failed,
+        "wall_time": wall_time,
+        "items_per_second": items / wall_time if wall_time else 0.0,
+        "db_write_time": news_api.DB_WRITE_TIME - write_time,
+        "keyword_time": keyword_time,
+    }
+
+
+def add_benchmark_commands(app):
+    """
+    Called in app.py to add the replay server and benchmark commands to flask
+
+    Parameters:
+        app: Flask app object
+    """
+    app.cli.add_command(replay_server_command)
+    app.cli.add_command(record_fixtures_command)
+    app.cli.add_command(benchmark_ingest_command)
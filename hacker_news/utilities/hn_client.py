@@ -0,0 +1,310 @@
+"""
+Shared HTTP client for the Hacker News API. A single pooled aiohttp session is
+kept for the running event loop so every request made during a refresh reuses
+the same keep-alive connections, and a semaphore caps how many requests are in
+flight at once.
+
+Requests have a deadline and are retried with jittered backoff. Slow requests
+can be hedged with a duplicate, and a circuit breaker fails requests fast once
+the API looks degraded
+
+Classes:
+    CircuitOpenError
+    CircuitBreaker
+    HackerNewsClient
+
+Methods:
+    get_client()
+    close_client()
+
+Variables:
+    DEFAULT_CONCURRENCY
+    DEFAULT_LIMIT_PER_HOST
+    DEFAULT_KEEPALIVE_TIMEOUT
+    DEFAULT_DNS_CACHE_TTL
+    DEFAULT_TIMEOUT
+    DEFAULT_RETRIES
+    DEFAULT_BACKOFF
+    DEFAULT_BACKOFF_MAX
+    DEFAULT_BREAKER_THRESHOLD
+    DEFAULT_BREAKER_RESET
+    FETCH_ERRORS
+"""
+
+import asyncio
+import json
+import random
+from time import monotonic
+import aiohttp
+from flask import current_app, has_app_context
+from .metrics import metrics_registry
+
+DEFAULT_CONCURRENCY = 50
+DEFAULT_LIMIT_PER_HOST = 50
+DEFAULT_KEEPALIVE_TIMEOUT = 30
+DEFAULT_DNS_CACHE_TTL = 300
+DEFAULT_TIMEOUT = 10
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.25
+DEFAULT_BACKOFF_MAX = 4
+DEFAULT_BREAKER_THRESHOLD = 20
+DEFAULT_BREAKER_RESET = 30
+# Errors a request can end with once its retries are used up, ValueError is a
+# truncated or malformed JSON body
+FETCH_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ValueError)
+
+_client = None
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a request while the circuit breaker is open
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops requests to the API after too many consecutive failures, then lets
+    them through again after a cool down
+
+    Attributes:
+        threshold: Consecutive failures that open the circuit
+        reset_timeout: Seconds the circuit stays open before requests are tried
+            again
+        failures: Current number of consecutive failures
+
+    Methods:
+        is_open(self): Whether requests are currently blocked
+        record_success(self): Close the circuit after a successful request
+        record_failure(self): Count a failed request
+    """
+
+    def __init__(
+        self, threshold=DEFAULT_BREAKER_THRESHOLD, reset_timeout=DEFAULT_BREAKER_RESET
+    ):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+
+    def is_open(self):
+        if self._opened_at is None:
+            return False
+        # After the cool down a request is let through, and one more failure
+        # opens the circuit again
+        return monotonic() - self._opened_at < self.reset_timeout
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.threshold and self.failures >= self.threshold:
+            self._opened_at = monotonic()
+
+
+class HackerNewsClient:
+    """
+    A long-lived, connection pooled client for making requests to the Hacker
+    News API
+
+    Attributes:
+        concurrency: Max number of requests in flight at once
+        limit_per_host: Max number of open connections to a single host
+        keepalive_timeout: Seconds an idle connection is kept open for reuse
+        dns_cache_ttl: Seconds a resolved host is cached for
+        timeout: Seconds a single request can take
+        retries: Times a failed request is retried
+        backoff: Seconds the first retry waits at most, doubled for each retry
+        backoff_max: Seconds any retry waits at most
+        hedge_delay: Seconds before a slow request is duplicated, None to never
+            duplicate requests
+        breaker: The CircuitBreaker requests go through
+
+    Methods:
+        get_json(self, url): Make a GET request and return the decoded JSON
+        close(self): Close the underlying session and its connections
+    """
+
+    def __init__(
+        self,
+        concurrency=DEFAULT_CONCURRENCY,
+        limit_per_host=DEFAULT_LIMIT_PER_HOST,
+        keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+        dns_cache_ttl=DEFAULT_DNS_CACHE_TTL,
+        timeout=DEFAULT_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        backoff_max=DEFAULT_BACKOFF_MAX,
+        hedge_delay=None,
+        breaker=None,
+    ):
+        self.concurrency = concurrency
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+        self._semaphore = None
+        self._loop = None
+
+    def _get_session(self):
+        # aiohttp sessions are bound to the loop they were created on, so a new
+        # pool is opened whenever the client is used from a different loop
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._session
+
+    async def get_json(self, url):
+        """
+        Make a GET request and return the decoded JSON body, retrying failures
+        with jittered exponential backoff
+
+        Parameters:
+            url (string): The url to request
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open
+            FETCH_ERRORS: If the request failed and can't be retried
+
+        Returns:
+            response: The decoded JSON body
+        """
+        for attempt in range(self.retries + 1):
+            if self.breaker.is_open():
+                raise CircuitOpenError(url)
+            try:
+                response = await self._hedged_get(url)
+                self.breaker.record_success()
+                return response
+            except aiohttp.ClientResponseError as error:
+                # Client errors other than rate limiting won't succeed on retry
+                if error.status < 500 and error.status != 429:
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.retries:
+                    raise
+            except FETCH_ERRORS:
+                self.breaker.record_failure()
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(
+                random.uniform(0, min(self.backoff_max, self.backoff * 2**attempt))
+            )
+
+    async def _hedged_get(self, url):
+        # A duplicate request is sent when the first is slower than hedge_delay,
+        # and whichever succeeds first is used
+        if not self.hedge_delay:
+            return await self._get(url)
+
+        tasks = {asyncio.create_task(self._get(url))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if not done:
+                tasks.add(asyncio.create_task(self._get(url)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _get(self, url):
+        session = self._get_session()
+        async with self._semaphore:
+            start, status = monotonic(), "error"
+            try:
+                async with session.get(
+                    url, timeout=aiohttp.ClientTimeout(total=self.timeout)
+                ) as res:
+                    status = str(res.status)
+                    res.raise_for_status()
+                    body = await res.read()
+            except asyncio.TimeoutError:
+                status = "timeout"
+                raise
+            except asyncio.CancelledError:
+                # Hedged duplicates are cancelled once the other one answers
+                status = "cancelled"
+                raise
+            finally:
+                metrics_registry.observe("hn_api_request_seconds", monotonic() - start)
+                metrics_registry.inc("hn_api_requests_total", status=status)
+        metrics_registry.inc("hn_api_downloaded_bytes_total", len(body))
+        return json.loads(body)
+
+    async def close(self):
+        """
+        Close the underlying session and all of its pooled connections
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._semaphore = None
+        self._loop = None
+
+
+def get_client():
+    """
+    Get the process wide Hacker News API client, creating it from the Flask
+    config on first use
+
+    Returns:
+        client (HackerNewsClient): The shared client
+    """
+    global _client
+    if _client is None:
+        config = current_app.config if has_app_context() else {}
+        _client = HackerNewsClient(
+            concurrency=config.get("HN_API_CONCURRENCY", DEFAULT_CONCURRENCY),
+            limit_per_host=config.get("HN_API_LIMIT_PER_HOST", DEFAULT_LIMIT_PER_HOST),
+            keepalive_timeout=config.get(
+                "HN_API_KEEPALIVE_TIMEOUT", DEFAULT_KEEPALIVE_TIMEOUT
+            ),
+            dns_cache_ttl=config.get("HN_API_DNS_CACHE_TTL", DEFAULT_DNS_CACHE_TTL),
+            timeout=config.get("HN_API_TIMEOUT", DEFAULT_TIMEOUT),
+            retries=config.get("HN_API_RETRIES", DEFAULT_RETRIES),
+            backoff=config.get("HN_API_BACKOFF", DEFAULT_BACKOFF),
+            backoff_max=config.get("HN_API_BACKOFF_MAX", DEFAULT_BACKOFF_MAX),
+            hedge_delay=config.get("HN_API_HEDGE_DELAY"),
+            breaker=CircuitBreaker(
+                threshold=config.get(
+                    "HN_API_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD
+                ),
+                reset_timeout=config.get("HN_API_BREAKER_RESET", DEFAULT_BREAKER_RESET),
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    """
+    Close the shared client's connections. Called when the event loop that
+    owns them is about to finish
+    """
+    if _client is not None:
+        await _client.close()
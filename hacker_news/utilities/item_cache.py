@@ -0,0 +1,165 @@
+"""
+In memory cache of Hacker News API items. How long an item is kept grows with
+its age, since new stories and comments change often while old ones almost
+never do
+
+Classes:
+    ItemCache
+
+Variables:
+    DEFAULT_CACHE_SIZE
+    DEFAULT_MIN_TTL
+    DEFAULT_MAX_TTL
+    DEFAULT_TTL_FACTOR
+    item_cache
+"""
+
+import threading
+from collections import OrderedDict
+from time import time
+
+DEFAULT_CACHE_SIZE = 50000
+DEFAULT_MIN_TTL = 60
+DEFAULT_MAX_TTL = 6 * 60 * 60
+# Fraction of an item's age it is cached for
+DEFAULT_TTL_FACTOR = 0.1
+
+
+class ItemCache:
+    """
+    A size bounded, least recently used item cache with age aware expiry
+
+    Attributes:
+        max_entries: Number of items kept before the least recently used are
+            evicted
+        min_ttl: Seconds the newest items are cached for
+        max_ttl: Seconds the oldest items are cached for
+        ttl_factor: Fraction of an item's age it is cached for, between min_ttl
+            and max_ttl
+        hits: Number of lookups that found a fresh item
+        misses: Number of lookups that didn't
+
+    Methods:
+        init_app(self, app): Configure the cache from a Flask app
+        get_ttl(self, item): Get how long an item is cached for
+        get(self, item_id): Get a cached item
+        set(self, item): Cache an item
+        invalidate(self, item_ids): Remove items from the cache
+        clear(self): Remove every item from the cache
+        stats(self): Get the hit, miss and entry counts of the cache
+    """
+
+    def __init__(
+        self,
+        max_entries=DEFAULT_CACHE_SIZE,
+        min_ttl=DEFAULT_MIN_TTL,
+        max_ttl=DEFAULT_MAX_TTL,
+        ttl_factor=DEFAULT_TTL_FACTOR,
+    ):
+        self.max_entries = max_entries
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.ttl_factor = ttl_factor
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the cache from a Flask app
+
+        Parameters:
+            app: Flask app object
+        """
+        self.max_entries = app.config.get("ITEM_CACHE_SIZE", self.max_entries)
+        self.min_ttl = app.config.get("ITEM_CACHE_MIN_TTL", self.min_ttl)
+        self.max_ttl = app.config.get("ITEM_CACHE_MAX_TTL", self.max_ttl)
+        self.ttl_factor = app.config.get("ITEM_CACHE_TTL_FACTOR", self.ttl_factor)
+
+    def get_ttl(self, item):
+        """
+        Get how long an item is cached for, based on when it was posted
+
+        Parameters:
+            item (dict): A dictionary with the item's information
+
+        Returns:
+            ttl (float): Seconds the item is cached for
+        """
+        age = max(time() - item.get("time", time()), 0)
+        return min(max(age * self.ttl_factor, self.min_ttl), self.max_ttl)
+
+    def get(self, item_id):
+        """
+        Get a cached item if it hasn't expired
+
+        Parameters:
+            item_id (int): ID of the item
+
+        Returns:
+            item (dict): A copy of the cached item, or None
+        """
+        with self._lock:
+            if cached := self._items.get(item_id):
+                expires, item = cached
+                if expires > time():
+                    self._items.move_to_end(item_id)
+                    self.hits += 1
+                    # Callers replace 'kids' with the nested items they fetch
+                    return dict(item)
+                del self._items[item_id]
+            self.misses += 1
+            return None
+
+    def set(self, item):
+        """
+        Cache an item, evicting the least recently used items when full
+
+        Parameters:
+            item (dict): A dictionary with the item's information
+        """
+        if not item or "id" not in item or not self.max_entries:
+            return
+        with self._lock:
+            self._items[item["id"]] = (time() + self.get_ttl(item), dict(item))
+            self._items.move_to_end(item["id"])
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def invalidate(self, item_ids):
+        """
+        Remove items from the cache, such as ones known to have changed
+
+        Parameters:
+            item_ids (list): IDs of the items to remove
+        """
+        with self._lock:
+            for item_id in item_ids:
+                self._items.pop(item_id, None)
+
+    def clear(self):
+        """
+        Remove every item from the cache and reset its counters
+        """
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """
+        Get the hit, miss and entry counts of the cache
+
+        Returns:
+            stats (dict): Counts of hits, misses and entries, and the hit rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._items),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+item_cache = ItemCache()
@@ -0,0 +1,261 @@
+"""
+Content addressed cache of extracted keywords, persisted to a SQLite file that
+every worker process shares. Entries are keyed by a hash of the normalized
+title and the keyword model's version, so a title is only ever run through
+the model once per model.
+
+Lookups only read. The recency and hit counts they produce are kept in memory
+and written together with the next write, or once enough of them pile up
+
+Classes:
+    KeywordCache
+
+Variables:
+    DEFAULT_CACHE_PATH
+    DEFAULT_CACHE_SIZE
+    TOUCH_BATCH_SIZE
+    TOUCH_INTERVAL
+    keyword_cache
+"""
+
+import hashlib
+import sqlite3
+import threading
+from importlib.metadata import version, PackageNotFoundError
+from collections import Counter
+from time import time
+from ..db import MAX_QUERY_IDS
+from .metrics import metrics_registry
+
+DEFAULT_CACHE_PATH = "hacker_news/db/keyword_cache.db"
+DEFAULT_CACHE_SIZE = 100000
+# Lookups recorded in memory, and seconds since the last write, before they're
+# written on their own
+TOUCH_BATCH_SIZE = 1000
+TOUCH_INTERVAL = 60
+
+
+class KeywordCache:
+    """
+    A size bounded, least recently used keyword cache on disk
+
+    Attributes:
+        path: Path of the SQLite file the cache is stored in
+        max_entries: Number of entries kept before the least recently used are
+            evicted
+        model_version: Version of the keyword model entries are valid for
+
+    Methods:
+        init_app(self, app, model_name): Configure the cache from a Flask app
+        make_key(self, title): Get the cache key of a title
+        get_many(self, titles): Get the cached keywords of many titles
+        set_many(self, keywords): Add the keywords of many titles
+        flush(self): Write the recorded lookups
+        stats(self): Get the hit, miss and entry counts of the cache
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_PATH,
+        max_entries=DEFAULT_CACHE_SIZE,
+        model_version="default",
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.model_version = model_version
+        self._local = threading.local()
+        # Keys mapped to when they were last read, and hit and miss counts,
+        # not written yet
+        self._touches = {}
+        self._counts = Counter()
+        self._flushed_at = time()
+        self._touch_lock = threading.Lock()
+
+    def init_app(self, app, model_name=None):
+        """
+        Configure the cache from a Flask app
+
+        Parameters:
+            app: Flask app object
+            model_name (string): Name of the keyword model, None for the default
+        """
+        self.path = app.config.get("KEYWORD_CACHE_PATH", self.path)
+        self.max_entries = app.config.get("KEYWORD_CACHE_SIZE", self.max_entries)
+        try:
+            keybert_version = version("keybert")
+        except PackageNotFoundError:
+            keybert_version = "unknown"
+        self.model_version = f"keybert-{keybert_version}:{model_name or 'default'}"
+        self._local = threading.local()
+
+    def _get_connection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS keywords "
+                "(key TEXT PRIMARY KEY, keywords TEXT NOT NULL, "
+                "last_used REAL NOT NULL)"
+                " WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_keywords_last_used "
+                "ON keywords (last_used)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS stats "
+                "(name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+            connection.commit()
+            self._local.connection = connection
+        return connection
+
+    def make_key(self, title):
+        """
+        Get the cache key of a title. Titles that only differ in case or
+        whitespace share a key
+
+        Parameters:
+            title (string): A story title
+
+        Returns:
+            key (string): A hex digest of the normalized title and model version
+        """
+        normalized_title = " ".join((title or "").casefold().split())
+        return hashlib.sha256(
+            f"{self.model_version}\0{normalized_title}".encode()
+        ).hexdigest()
+
+    def get_many(self, titles):
+        """
+        Get the cached keywords of many titles and count the hits and misses
+
+        Parameters:
+            titles (list): A list of story titles
+
+        Returns:
+            keywords (dict): The titles found in the cache mapped to their keywords
+        """
+        keys = {self.make_key(title): title for title in titles}
+        if not keys:
+            return {}
+
+        connection = self._get_connection()
+        found, key_list = {}, list(keys)
+        for i in range(0, len(key_list), MAX_QUERY_IDS):
+            batch = key_list[i : i + MAX_QUERY_IDS]
+            rows = connection.execute(
+                "SELECT key, keywords FROM keywords "
+                f"WHERE key IN ({', '.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            found.update(rows)
+
+        now = time()
+        with self._touch_lock:
+            self._touches.update((key, now) for key in found)
+            self._counts.update(hits=len(found), misses=len(keys) - len(found))
+            due = (
+                len(self._touches) >= TOUCH_BATCH_SIZE
+                or now - self._flushed_at > TOUCH_INTERVAL
+            )
+        if due:
+            self.flush()
+        metrics_registry.inc(
+            "hn_cache_lookups_total", len(found), cache="keyword", result="hit"
+        )
+        metrics_registry.inc(
+            "hn_cache_lookups_total",
+            len(keys) - len(found),
+            cache="keyword",
+            result="miss",
+        )
+
+        return {keys[key]: keywords for key, keywords in found.items()}
+
+    def set_many(self, keywords):
+        """
+        Add the keywords of many titles, evicting the least recently used
+        entries when the cache is full
+
+        Parameters:
+            keywords (dict): Story titles mapped to their keywords
+        """
+        if not keywords:
+            return
+
+        connection = self._get_connection()
+        now = time()
+        with connection:
+            # Entries read since the last write count as used before evicting
+            self._write_touches(connection)
+            connection.executemany(
+                "INSERT INTO keywords (key, keywords, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                "keywords = excluded.keywords, last_used = excluded.last_used",
+                [
+                    (self.make_key(title), title_keywords, now)
+                    for title, title_keywords in keywords.items()
+                ],
+            )
+            evicted = connection.execute(
+                "DELETE FROM keywords WHERE key IN "
+                "(SELECT key FROM keywords ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self._increment(connection, "evictions", evicted)
+
+    def flush(self):
+        """
+        Write the last used times and hit and miss counts recorded by lookups
+        """
+        connection = self._get_connection()
+        with connection:
+            self._write_touches(connection)
+
+    def _write_touches(self, connection):
+        with self._touch_lock:
+            touches, counts = self._touches, self._counts
+            self._touches, self._counts = {}, Counter()
+            self._flushed_at = time()
+        connection.executemany(
+            "UPDATE keywords SET last_used = max(last_used, ?) WHERE key = ?",
+            [(last_used, key) for key, last_used in touches.items()],
+        )
+        for name, amount in counts.items():
+            self._increment(connection, name, amount)
+
+    def stats(self):
+        """
+        Get the hit, miss and entry counts of the cache
+
+        Returns:
+            stats (dict): Counts of hits, misses, evictions and entries, and the
+                hit rate
+        """
+        connection = self._get_connection()
+        stats = {"hits": 0, "misses": 0, "evictions": 0}
+        stats.update(connection.execute("SELECT name, value FROM stats").fetchall())
+        with self._touch_lock:
+            for name, amount in self._counts.items():
+                stats[name] += amount
+        stats["entries"] = connection.execute(
+            "SELECT COUNT(*) FROM keywords"
+        ).fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    @staticmethod
+    def _increment(connection, name, amount):
+        if amount:
+            connection.execute(
+                "INSERT INTO stats (name, value) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                (name, amount),
+            )
+
+
+keyword_cache = KeywordCache()
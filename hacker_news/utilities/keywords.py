@@ -0,0 +1,342 @@
+"""
+Process wide keyword extraction. The KeyBERT model is loaded lazily once per
+process and reused by every refresh instead of being rebuilt on each call.
+
+New stories are inserted with their keywords pending, and a background stage
+fills them in batches on a pool of worker processes so a refresh never waits
+on model inference. Results are added to the keyword cache
+
+Classes:
+    KeywordExtractor
+
+Methods:
+    start_keyword_extraction(app)
+    extract_pending_keywords(wait)
+    get_keyword_pool()
+    warm_keyword_pool()
+    shutdown_keyword_pool()
+    shutdown_idle_keyword_pool(max_idle)
+
+Variables:
+    KEYWORDS_BATCH_SIZE
+    DEFAULT_KEYWORD_WORKERS
+    DEFAULT_IDLE_TIMEOUT
+    keyword_extractor
+"""
+
+import gc
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+from flask import current_app
+from keybert import KeyBERT
+from ..db import db, Story
+from .keyword_cache import keyword_cache
+from .metrics import metrics_registry
+
+KEYWORDS_BATCH_SIZE = 64
+# Every worker loads its own model, and every web worker process can start a
+# pool, so more are only worth their memory on a dedicated machine
+DEFAULT_KEYWORD_WORKERS = 1
+# Seconds the model and pool can go unused before they're released,
+# KEYWORD_MODEL_IDLE_TIMEOUT overrides it and 0 keeps them loaded
+DEFAULT_IDLE_TIMEOUT = 900
+
+_pool = None
+_pool_last_used = None
+_pool_lock = threading.Lock()
+_extraction_lock = threading.Lock()
+
+
+class KeywordExtractor:
+    """
+    A lazily loaded, reusable KeyBERT model
+
+    Attributes:
+        model_name: Sentence-transformer model KeyBERT uses, None for its default
+        last_used: Unix time the model last extracted keywords
+
+    Methods:
+        init_app(self, app): Configure the extractor from a Flask app
+        warm(self): Load the model if it isn't loaded
+        unload(self): Release the model and its memory
+        unload_if_idle(self, max_idle): Release the model if unused for a while
+        extract(self, titles): Extract keywords for a batch of titles
+    """
+
+    def __init__(self, model_name=None):
+        self.model_name = model_name
+        self.last_used = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def init_app(self, app):
+        """
+        Configure the extractor and its keyword cache from a Flask app. With
+        KEYWORD_MODEL_PREWARM set the model is loaded right away where
+        extraction runs, in the keyword pool, or in this process when
+        KEYWORD_WORKERS is 0
+
+        Parameters:
+            app: Flask app object
+        """
+        self.model_name = app.config.get("KEYWORD_MODEL", self.model_name)
+        keyword_cache.init_app(app, model_name=self.model_name)
+        if app.config.get("KEYWORD_MODEL_PREWARM"):
+            with app.app_context():
+                if not warm_keyword_pool():
+                    self.warm()
+
+    def warm(self):
+        """
+        Load the model if it isn't loaded
+
+        Returns:
+            model (KeyBERT): The loaded model
+        """
+        with self._lock:
+            if self._model is None:
+                self._model = KeyBERT(self.model_name) if self.model_name else KeyBERT()
+                self.last_used = time()
+            return self._model
+
+    def unload(self):
+        """
+        Release the model so its memory can be reclaimed. It is loaded again on
+        next use
+        """
+        with self._lock:
+            self._model = None
+        gc.collect()
+
+    def unload_if_idle(self, max_idle):
+        """
+        Release the model if it hasn't been used for a while
+
+        Parameters:
+            max_idle (int): Seconds the model can be unused before it's released
+
+        Returns:
+            A bool of whether the model was released
+        """
+        if self.loaded and self.last_used and time() - self.last_used > max_idle:
+            self.unload()
+            return True
+        return False
+
+    def extract(self, titles):
+        """
+        Extract keywords for a batch of titles with one call to the model
+
+        Parameters:
+            titles (list): A list of story titles
+
+        Returns:
+            keywords (list): A string of space separated keywords for each title
+        """
+        keywords = ["" for _ in titles]
+        # KeyBERT can't extract from empty documents
+        indexes = [i for i, title in enumerate(titles) if title and title.strip()]
+        if not indexes:
+            return keywords
+
+        model = self.warm()
+        self.last_used = time()
+        docs = [titles[i] for i in indexes]
+        try:
+            keywords_lists = model.extract_keywords(docs)
+            # KeyBERT unwraps the result when given a single document
+            if len(docs) == 1:
+                keywords_lists = [keywords_lists]
+        except ValueError:
+            # Raised when no title in the batch has a usable word
+            keywords_lists = [[] for _ in docs]
+
+        for i, keywords_list in zip(indexes, keywords_lists):
+            keywords[i] = " ".join([keyword[0] for keyword in keywords_list])
+        return keywords
+
+
+keyword_extractor = KeywordExtractor()
+
+
+def _init_pool_worker(model_name):
+    # Every worker process loads its own model once, before taking any batch
+    keyword_extractor.model_name = model_name
+    keyword_extractor.warm()
+
+
+def _extract_batch(titles):
+    return keyword_extractor.extract(titles)
+
+
+def _warm_worker():
+    # The initializer already loaded the model
+    return None
+
+
+def _get_worker_count():
+    return current_app.config.get("KEYWORD_WORKERS", DEFAULT_KEYWORD_WORKERS)
+
+
+def get_keyword_pool():
+    """
+    Get the pool of keyword extraction processes, starting it on first use.
+    Sized by KEYWORD_WORKERS, which defaults to DEFAULT_KEYWORD_WORKERS
+
+    Returns:
+        pool (ProcessPoolExecutor): The pool, or None if KEYWORD_WORKERS is 0
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None and (workers := _get_worker_count()):
+            # Forking a process with loaded torch and scheduler threads isn't safe
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_pool_worker,
+                initargs=(keyword_extractor.model_name,),
+            )
+        return _pool
+
+
+def warm_keyword_pool():
+    """
+    Start every keyword extraction process, which load their models in the
+    background, without waiting for them
+
+    Returns:
+        A bool of whether there is a pool to warm
+    """
+    global _pool_last_used
+    if not (pool := get_keyword_pool()):
+        return False
+    # Workers are only started while none is idle, so every task starts one
+    for _ in range(_get_worker_count()):
+        pool.submit(_warm_worker)
+    _pool_last_used = time()
+    return True
+
+
+def shutdown_keyword_pool():
+    """
+    Stop the keyword extraction processes and release their models
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def shutdown_idle_keyword_pool(max_idle):
+    """
+    Stop the keyword extraction processes if they haven't been used for a while
+
+    Parameters:
+        max_idle (int): Seconds the pool can be unused before it's stopped
+
+    Returns:
+        A bool of whether the pool was stopped
+    """
+    if _pool is not None and _pool_last_used and time() - _pool_last_used > max_idle:
+        shutdown_keyword_pool()
+        return True
+    return False
+
+
+def start_keyword_extraction(app):
+    """
+    Fill pending story keywords on a background thread. Does nothing if
+    extraction is already running in this process, or KEYWORD_EXTRACTION is off
+
+    Parameters:
+        app: Flask app object
+    """
+    if not app.config.get("KEYWORD_EXTRACTION", True):
+        return
+
+    def run():
+        with app.app_context():
+            extract_pending_keywords()
+
+    threading.Thread(target=run, name="keyword-extraction", daemon=True).start()
+
+
+def extract_pending_keywords(wait=False):
+    """
+    Extract keywords for every story marked pending, in batches spread across
+    the keyword pool, until none are left
+
+    Parameters:
+        wait (bool): Wait for an extraction already running in this process to
+            finish, then extract whatever it left pending, instead of returning
+
+    Returns:
+        count (int): Number of stories that got keywords
+    """
+    if not _extraction_lock.acquire(blocking=wait):
+        return 0
+    if wait:
+        # Ends this session's read, which wouldn't see what the other
+        # extraction wrote
+        db.session.commit()
+
+    global _pool_last_used
+    count = 0
+    try:
+        pool = get_keyword_pool()
+        batch_count = _get_worker_count() or 1
+        while stories := db.session.execute(
+            db.select(Story.id, Story.title)
+            .filter_by(keywords_pending=True)
+            .limit(KEYWORDS_BATCH_SIZE * batch_count)
+        ).all():
+            batches = [
+                stories[i : i + KEYWORDS_BATCH_SIZE]
+                for i in range(0, len(stories), KEYWORDS_BATCH_SIZE)
+            ]
+            titles = [[story.title or "" for story in batch] for batch in batches]
+            with metrics_registry.timer(
+                "hn_ingest_phase_seconds", phase="keyword_extraction"
+            ):
+                if pool:
+                    _pool_last_used = time()
+                    keywords = list(pool.map(_extract_batch, titles))
+                else:
+                    keywords = [keyword_extractor.extract(batch) for batch in titles]
+
+            keyword_cache.set_many(
+                {
+                    title: title_keywords
+                    for batch_titles, batch_keywords in zip(titles, keywords)
+                    for title, title_keywords in zip(batch_titles, batch_keywords)
+                }
+            )
+            db.session.bulk_update_mappings(
+                Story,
+                [
+                    {
+                        "id": story.id,
+                        "keywords": story_keywords,
+                        "keywords_pending": False,
+                    }
+                    for batch, batch_keywords in zip(batches, keywords)
+                    for story, story_keywords in zip(batch, batch_keywords)
+                ],
+            )
+            db.session.commit()
+            count += len(stories)
+    finally:
+        _extraction_lock.release()
+        metrics_registry.inc("hn_keywords_extracted_total", count)
+        metrics_registry.set(
+            "hn_cache_hit_ratio", keyword_cache.stats()["hit_rate"], cache="keyword"
+        )
+        metrics_registry.flush()
+    return count
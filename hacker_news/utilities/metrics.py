@@ -0,0 +1,208 @@
+"""
+Registry of ingestion metrics in the Prometheus text format. Samples are
+buffered in memory and flushed to a SQLite file that every worker process
+shares, so counters add up across processes and the '/metrics' endpoint of any
+worker shows the whole app
+
+Classes:
+    MetricsRegistry
+
+Variables:
+    DEFAULT_METRICS_PATH
+    LATENCY_BUCKETS
+    PHASE_BUCKETS
+    metrics_registry
+"""
+
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from time import time
+
+DEFAULT_METRICS_PATH = "hacker_news/db/metrics.db"
+# Upper bounds in seconds of the histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms shared by every process of the app
+
+    Attributes:
+        path: Path of the SQLite file the samples are stored in
+
+    Methods:
+        init_app(self, app): Configure the registry from a Flask app
+        inc(self, name, amount, **labels): Add to a counter
+        set(self, name, value, **labels): Set a gauge
+        observe(self, name, value, buckets, **labels): Add a value to a histogram
+        timer(self, name, buckets, **labels): Observe how long a block takes
+        flush(self): Write the buffered samples to the shared file
+        render(self): Get every metric in the Prometheus text format
+    """
+
+    def __init__(self, path=DEFAULT_METRICS_PATH):
+        self.path = path
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app):
+        """
+        Configure the registry from a Flask app
+
+        Parameters:
+            app: Flask app object
+        """
+        self.path = app.config.get("METRICS_PATH", self.path)
+        self._local = threading.local()
+
+    def _get_connection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS samples "
+                "(name TEXT NOT NULL, labels TEXT NOT NULL, family TEXT NOT NULL, "
+                "kind TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels))"
+                " WITHOUT ROWID"
+            )
+            connection.commit()
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _format_labels(labels):
+        values = {
+            key: str(value).replace("\\", "\\\\").replace('"', '\\"')
+            for key, value in labels.items()
+        }
+        return ",".join(f'{key}="{value}"' for key, value in sorted(values.items()))
+
+    @staticmethod
+    def _sort_key(row):
+        # Buckets of a series are listed together, from the smallest bound up
+        family, _, name, labels, _ = row
+        bound = re.search(r'(?:^|,)le="([^"]+)"', labels)
+        series = re.sub(r'(?:^|,)le="[^"]+"', "", labels).strip(",")
+        return family, series, name, float(bound.group(1)) if bound else 0.0
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Add to a counter
+
+        Parameters:
+            name (string): Metric name, ending in '_total' by convention
+            amount (float): Amount to add
+            **labels: Labels of the series
+        """
+        key = (name, self._format_labels(labels), name, "counter")
+        with self._lock:
+            self._counters[key] += amount
+
+    def set(self, name, value, **labels):
+        """
+        Set a gauge, the last value set by any process wins
+
+        Parameters:
+            name (string): Metric name
+            value (float): Value of the gauge
+            **labels: Labels of the series
+        """
+        key = (name, self._format_labels(labels), name, "gauge")
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """
+        Add a value to a histogram
+
+        Parameters:
+            name (string): Metric name
+            value (float): Value observed
+            buckets (tuple): Upper bounds of the histogram buckets
+            **labels: Labels of the series
+        """
+        series = self._format_labels(labels)
+        with self._lock:
+            for bound in (*buckets, "+Inf"):
+                if bound == "+Inf" or value <= bound:
+                    bucket = self._format_labels({**labels, "le": bound})
+                    self._counters[(f"{name}_bucket", bucket, name, "histogram")] += 1
+            self._counters[(f"{name}_sum", series, name, "histogram")] += value
+            self._counters[(f"{name}_count", series, name, "histogram")] += 1
+
+    @contextmanager
+    def timer(self, name, buckets=PHASE_BUCKETS, **labels):
+        """
+        Observe how long the block inside the 'with' statement takes in seconds
+
+        Parameters:
+            name (string): Metric name
+            buckets (tuple): Upper bounds of the histogram buckets
+            **labels: Labels of the series
+        """
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(name, time() - start, buckets=buckets, **labels)
+
+    def flush(self):
+        """
+        Write the buffered samples to the shared file. Counters and histograms
+        are added to what other processes wrote, gauges replace it
+        """
+        with self._lock:
+            counters, self._counters = self._counters, defaultdict(float)
+            gauges, self._gauges = self._gauges, {}
+        if not counters and not gauges:
+            return
+
+        connection = self._get_connection()
+        with connection:
+            connection.executemany(
+                "INSERT INTO samples (name, labels, family, kind, value) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                [(*key, value) for key, value in counters.items()],
+            )
+            connection.executemany(
+                "INSERT INTO samples (name, labels, family, kind, value) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (name, labels) DO UPDATE SET value = excluded.value",
+                [(*key, value) for key, value in gauges.items()],
+            )
+
+    def render(self):
+        """
+        Get every metric in the Prometheus text format, after flushing this
+        process's samples
+
+        Returns:
+            text (string): The metrics exposition
+        """
+        self.flush()
+        rows = (
+            self._get_connection()
+            .execute("SELECT family, kind, name, labels, value FROM samples")
+            .fetchall()
+        )
+
+        lines, family_seen = [], None
+        for family, kind, name, labels, value in sorted(rows, key=self._sort_key):
+            if family != family_seen:
+                lines.append(f"# TYPE {family} {kind}")
+                family_seen = family
+            series = f"{name}{{{labels}}}" if labels else name
+            lines.append(f"{series} {value!r}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
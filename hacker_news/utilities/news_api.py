@@ -3,85 +3,243 @@ Utilites for interacting with the Hacker News API and the database for all
 Hacker News data.
 
 Methods:
-    create_data()
-    update_data()
+    create_data(update, comments)
+    sync_data(comments)
+    update_data(comments)
     create_data_command(update)
     add_create_data_command(app)
     query_top_stories(count)
+    query_feed_stories(feed, after, count, at)
+    query_feed_fetch_id(feed, at)
     query_story(id)
     query_comments(story_id)
-    query_liked_stories()
-    query_disliked_stories()
+    query_liked_stories(user_id)
+    query_disliked_stories(user_id)
+    query_voted_stories(association_type, user_id)
+    query_story_votes(association_type, after, count)
     query_story_association_all(type)
     query_story_association_by_id(story_id, user_id)
+    query_vote_states(user_id, story_ids)
     edit_story(id, **kwargs)
     delete_story(id)
+    get_api_url()
     get_top_stories(count)
-    get_stories(url, count)
+    get_stories(feed, count, update)
+    get_feed_ids(feed, client)
+    get_feeds_ids(feeds)
+    get_ingest_feeds()
+    get_ranked_story_ids()
     get_comments(story)
-    async_fetch_item(client_session, item_id)
-    insert_stories_db(stories)
+    get_comment_trees(stories)
+    get_items(item_ids)
+    get_updates()
+    async_fetch_item(item_id, client)
+    insert_stories_db(stories, update)
     insert_comments_db(comments)
+    ingest_stories(story_ids, comments, update)
+    get_batch(queue)
+    run_in_app_context(app, func, *args)
+    write_rows(story_rows, comment_rows, update)
+    make_story_row(story)
+    make_comment_row(comment, comment_type)
+    save_rank_snapshot(feeds_ids)
+    prune_rank_snapshots()
+    get_synced_comment_counts(story_ids)
+    mark_comments_synced(story_ids)
+    add_cached_keywords(rows)
+    record_refresh(mode)
+    db_write_timer()
+    record_rows(table, counts)
+    get_sync_checkpoint(scope)
+    save_sync_checkpoint(comments)
+    clear_sync_checkpoint()
 
 Variables:
+    API_URL
+    FEEDS
     MAX_STORY_COUNT
-    UPDATE_DB
-    UPDATE_COMMENTS
+    DELTA_SYNC_MAX_AGE
+    RANK_SNAPSHOT_RETENTION
+    INGEST_QUEUE_SIZE
+    INGEST_BATCH_SIZE
     IDS_QUERIED
+    IDS_FAILED
+    DB_WRITE_TIME
 """
 
+from contextlib import contextmanager
+from math import inf
 from os.path import exists
 from time import time
 import asyncio
-import aiohttp
 import click
-import requests
+from flask import current_app
 from flask.cli import with_appcontext
-from keybert import KeyBERT
+from .hn_client import get_client, close_client, CircuitOpenError, FETCH_ERRORS
+from .keywords import start_keyword_extraction, extract_pending_keywords
+from .keyword_cache import keyword_cache
+from .item_cache import item_cache
+from .metrics import metrics_registry, PHASE_BUCKETS
 from ..db import (
     db,
     Story,
     Comment,
+    RankFetch,
+    RankSnapshot,
     StoryAssociation,
+    User,
+    WebsiteSetting,
+    MAX_QUERY_IDS,
+    upsert_stories,
+    upsert_comments,
 )
 
-MAX_STORY_COUNT = 20
-# Enables or disables API query and database insertion of duplicate items
-UPDATE_DB = False
-UPDATE_COMMENTS = False
+# Default Hacker News API base url, HN_API_URL overrides it
+API_URL = "https://hacker-news.firebaseio.com/v0"
+# Feed names mapped to the Hacker News API endpoint listing their story IDs
+FEEDS = {
+    "top": "topstories",
+    "new": "newstories",
+    "best": "beststories",
+    "ask": "askstories",
+    "show": "showstories",
+    "job": "jobstories",
+}
+# Stories ingested from each feed, 500 is the most a feed lists
+MAX_STORY_COUNT = 500
+# Seconds a sync checkpoint stays usable, the updates feed only covers recent changes
+DELTA_SYNC_MAX_AGE = 900
+# Seconds rank snapshots are kept, RANK_SNAPSHOT_RETENTION overrides it
+RANK_SNAPSHOT_RETENTION = 86400
+# Max items waiting between ingestion stages, and rows written per transaction
+INGEST_QUEUE_SIZE = 1000
+INGEST_BATCH_SIZE = 500
 IDS_QUERIED = 0
+IDS_FAILED = 0
+DB_WRITE_TIME = 0
 
 
-async def create_data():
+async def create_data(update=False, comments=False):
     """
     Populates database with story and comment data, used in
     'create-data' flask command
+
+    Parameters:
+        update (bool): Determines whether to refetch and update the stories
+            already in the database, bypassing their cached copies. Comments
+            are served from the item cache until their age based TTL runs out
+        comments (bool): Determines whether to query for comments
+    """
+    try:
+        with record_refresh("full"):
+            # Stream stories and comments into the database as they're fetched
+            feeds_ids, story_ids = await get_ranked_story_ids()
+            if update:
+                # Scores and comment counts are what an update refetches stories for
+                item_cache.invalidate(story_ids)
+            # toggle = WebsiteSetting.find_item("toggle_comments")
+            await ingest_stories(story_ids=story_ids, comments=comments, update=update)
+            save_rank_snapshot(feeds_ids)
+        if get_client().breaker.is_open():
+            print("Hacker News API is degraded, saved a partial refresh")
+    finally:
+        # Connections are pooled for the lifetime of the event loop
+        await close_client()
+
+
+async def sync_data(comments=False):
+    """
+    Updates the database with only the items that changed since the last sync,
+    found with the Hacker News API 'updates' feed. Falls back to create_data()
+    when there is no recent sync checkpoint
+
+    Parameters:
+        comments (bool): Determines whether to query for comments
     """
-    # Insert Stories into database
-    stories = await get_top_stories(count=MAX_STORY_COUNT)
-    insert_stories_db(stories=stories)
+    # Comments have their own checkpoint since they aren't synced every time
+    scope = "comments" if comments else "stories"
+    checkpoint = get_sync_checkpoint(scope)
+    failed_before = IDS_FAILED
+    try:
+        if not checkpoint or time() - checkpoint["time"] > DELTA_SYNC_MAX_AGE:
+            await create_data(update=True, comments=comments)
+            if IDS_FAILED == failed_before:
+                save_sync_checkpoint(comments=comments)
+            return
+
+        with record_refresh("delta"):
+            (feeds_ids, story_ids), updates = await asyncio.gather(
+                get_ranked_story_ids(), get_updates()
+            )
+            changed_ids = set(updates.get("items", []))
+            item_cache.invalidate(changed_ids)
+
+            # Only new stories and stories that changed are fetched, the order of
+            # the rest is kept in the feed rankings
+            stored_ids = Story.find_existing_ids(story_ids)
+            synced_counts = get_synced_comment_counts(stored_ids) if comments else {}
+            fetched_stories = await get_items(
+                [
+                    story_id
+                    for story_id in story_ids
+                    if story_id not in stored_ids or story_id in changed_ids
+                ]
+            )
+            insert_stories_db(stories=fetched_stories, update=True)
+            save_rank_snapshot(feeds_ids)
+            start_keyword_extraction(current_app._get_current_object())
+
+            if comments:
+                # Stored comments that changed are refetched to update their text and flags
+                changed_comments = await get_items(
+                    Comment.find_existing_ids(changed_ids)
+                )
+
+                # Replies not in the database yet are fetched with their whole
+                # subtree, stories whose comment count didn't change have none
+                parents = changed_comments + [
+                    story
+                    for story in fetched_stories
+                    if story.get("descendants", 0) != synced_counts.get(story["id"])
+                ]
+                kid_ids = [kid for parent in parents for kid in parent.get("kids", [])]
+                stored_kid_ids = Comment.find_existing_ids(kid_ids)
+                new_comments = await get_comment_trees(
+                    [{"kids": [kid for kid in kid_ids if kid not in stored_kid_ids]}]
+                )
+
+                insert_comments_db(
+                    comments=[
+                        [{**comment, "kids": []} for comment in changed_comments],
+                        *new_comments,
+                    ]
+                )
+                if IDS_FAILED == failed_before:
+                    mark_comments_synced([story["id"] for story in fetched_stories])
 
-    # Insert Comments into database
-    # toggle = WebsiteSetting.find_item("toggle_comments")
-    if UPDATE_COMMENTS:
-        comments = [
-            await get_comments(story) for story in stories
-        ]  # List of lists of dicts
-        insert_comments_db(comments=comments)
+            if IDS_FAILED == failed_before:
+                save_sync_checkpoint(comments=comments)
+            else:
+                # Changes to the items that failed would be missed by the next delta
+                clear_sync_checkpoint()
+                print("Saved a partial sync, the next sync will be a full refresh")
+    finally:
+        await close_client()
 
 
 async def update_data(comments=False):
     """
     Updates database story data, used in 'get_new_api_data' APScheduler task.
-    Calls create_data()
+    Calls sync_data() when HN_SYNC_MODE is 'delta', the default, otherwise
+    create_data()
 
     Parameters:
         comments (bool): Determines whether to query for comments
     """
-    global UPDATE_DB, UPDATE_COMMENTS
-    UPDATE_DB = True
-    UPDATE_COMMENTS = comments
-    await create_data()
+    if current_app.config.get("HN_SYNC_MODE", "delta") == "delta":
+        await sync_data(comments=comments)
+    else:
+        await create_data(update=True, comments=comments)
 
 
 # Takes in flag '--update' to update the items already in the database, if any
@@ -98,11 +256,14 @@ def create_data_command(update: bool):
     if exists("hacker_news/db/database.db"):
         click.echo("** Adding Hacker News data **")
         start = time()
-        global UPDATE_DB
-        UPDATE_DB = update
-        asyncio.run(create_data())  # Start event loop for get_stories coroutine
+        # Start event loop for get_stories coroutine
+        asyncio.run(create_data(update=update))
+        # The background extraction thread doesn't outlive the command, so wait
+        # for it and extract anything it left pending
+        extract_pending_keywords(wait=True)
         click.echo(f"* Done in {round(time() - start, 3)} seconds *")
-        click.echo(f"* {IDS_QUERIED} IDs queried *")
+        click.echo(f"* {IDS_QUERIED} IDs queried, {IDS_FAILED} failed *")
+        click.echo(f"* Item cache hit rate {item_cache.stats()['hit_rate']:.1%} *")
     else:
         click.echo("Database not found. Check config.")
 
@@ -126,7 +287,8 @@ def add_create_data_command(app):
 
 def query_top_stories(count=1):
     """
-    Queries the database for the top stories, determined by order number
+    Queries the database for the top stories, determined by their rank in the
+    latest snapshot of the 'top' feed
 
     Parameters:
         count (int): The amount of stories to pull
@@ -134,11 +296,64 @@ def query_top_stories(count=1):
     Returns:
         stories (list): A list of Story objects
     """
-    return db.session.scalars(
-        db.select(Story).order_by(Story.order_num.desc()).limit(count)
+    return [story for _, story in query_feed_stories(feed="top", count=count)]
+
+
+def query_feed_stories(feed="top", after=0, count=20, at=None):
+    """
+    Queries the database for a page of a feed's stories in ranked order, from
+    the latest rank snapshot or the one current at a given time. Pages are
+    found by rank instead of offset, so later pages are as fast as the first
+
+    Parameters:
+        feed (string): The feed to pull stories from, a key of FEEDS
+        after (int): Rank of the last story on the previous page, 0 for the
+            first page
+        count (int): The amount of stories to pull
+        at (int): Unix time to show the feed as of. Defaults to now
+
+    Returns:
+        stories (list): A list of (rank, Story) tuples
+    """
+    return db.session.execute(
+        db.select(RankSnapshot.rank, Story)
+        .join(RankSnapshot.story)
+        .filter(
+            RankSnapshot.feed == feed,
+            RankSnapshot.fetch_id == query_feed_fetch_id(feed, at),
+            RankSnapshot.rank > after,
+        )
+        .order_by(RankSnapshot.rank)
+        .limit(count)
     ).all()
 
 
+def query_feed_fetch_id(feed, at=None):
+    """
+    Build the query for the fetch of a feed's latest rank snapshot, or of the
+    latest one taken at or before a given time
+
+    Parameters:
+        feed (string): The feed, a key of FEEDS
+        at (int): Unix time. Defaults to now
+
+    Returns:
+        query: A scalar subquery of the fetch ID
+    """
+    query = db.select(db.func.max(RankSnapshot.fetch_id)).filter(
+        RankSnapshot.feed == feed
+    )
+    if at is not None:
+        # Fetch IDs increase with time
+        query = query.filter(
+            RankSnapshot.fetch_id
+            <= db.select(db.func.max(RankFetch.id))
+            .filter(RankFetch.fetched_at <= at)
+            .scalar_subquery()
+        )
+    return query.scalar_subquery()
+
+
 def query_story(story_id):
     """
     Query the database for a story
@@ -163,32 +378,98 @@ def query_comments(story_id):
     Returns:
         comments (list): A list of Comment objects
     """
-    comments = db.session.scalars(db.select(Comment).filter_by(story_id=story_id)).all()
+    comments = db.session.scalars(
+        db.select(Comment).filter_by(story_id=story_id, type="root")
+    ).all()
     return comments
 
 
-def query_liked_stories():
+def query_liked_stories(user_id=None):
     """
     Query the database for all stories that are liked
 
+    Parameters:
+        user_id (string): Only get the stories this User liked. Optional
+
     Returns:
         liked_stories (list): A list of Story objects
     """
-    liked_stories = query_story_association_all(association_type="like")
-    liked_stories = [query_story(story.story_id) for story in liked_stories]
-    return liked_stories
+    return query_voted_stories(association_type="like", user_id=user_id)
 
 
-def query_disliked_stories():
+def query_disliked_stories(user_id=None):
     """
     Query the database for all stories that are disliked
 
+    Parameters:
+        user_id (string): Only get the stories this User disliked. Optional
+
     Returns:
         disliked_stories (list): A list of Story objects
     """
-    disliked_stories = query_story_association_all(association_type="dislike")
-    disliked_stories = [query_story(story.story_id) for story in disliked_stories]
-    return disliked_stories
+    return query_voted_stories(association_type="dislike", user_id=user_id)
+
+
+def query_voted_stories(association_type, user_id=None):
+    """
+    Query the database for the stories with a type of vote in one join, each
+    story once however many users voted on it
+
+    Parameters:
+        association_type (string): Type of StoryAssociation, like or dislike
+        user_id (string): Only get the stories this User voted on. Optional
+
+    Returns:
+        stories (list): A list of Story objects, newest story IDs first
+    """
+    voted = db.select(StoryAssociation.story_id).filter_by(type=association_type)
+    if user_id is not None:
+        voted = voted.filter_by(user_id=user_id)
+    return db.session.scalars(
+        db.select(Story).filter(Story.id.in_(voted)).order_by(Story.id.desc())
+    ).all()
+
+
+def query_story_votes(association_type, after=None, count=50):
+    """
+    Query the database for a page of the stories with a type of vote, with
+    their number of votes and the nicknames of the users who voted. Pages are
+    ordered by story ID, newest first, and continue after the last story ID of
+    the previous page, so every page reads only its own stories
+
+    Parameters:
+        association_type (string): Type of StoryAssociation, like or dislike
+        after (int): Story ID of the last story on the previous page. Optional
+        count (int): Number of stories on the page
+
+    Returns:
+        story_votes (list): (story, voters, votes) tuples, where voters is a
+            list of nicknames and votes the number of votes
+    """
+    query = (
+        db.select(Story, db.func.count())
+        .join(StoryAssociation, StoryAssociation.story_id == Story.id)
+        .filter(StoryAssociation.type == association_type)
+        .group_by(StoryAssociation.story_id)
+        .order_by(StoryAssociation.story_id.desc())
+        .limit(count)
+    )
+    if after is not None:
+        query = query.filter(StoryAssociation.story_id < after)
+    stories = db.session.execute(query).all()
+
+    voters = {}
+    for story_id, nickname in db.session.execute(
+        db.select(StoryAssociation.story_id, User.nickname)
+        .join(User, User.id == StoryAssociation.user_id)
+        .filter(
+            StoryAssociation.type == association_type,
+            StoryAssociation.story_id.in_([story.id for story, _ in stories]),
+        )
+        .order_by(User.nickname)
+    ):
+        voters.setdefault(story_id, []).append(nickname)
+    return [(story, voters.get(story.id, []), votes) for story, votes in stories]
 
 
 def query_story_association_all(association_type):
@@ -233,6 +514,33 @@ def query_story_association_by_id(story_id=None, user_id=None):
     return story_association
 
 
+def query_vote_states(user_id, story_ids):
+    """
+    Query the database for a user's likes and dislikes of many stories at
+    once, using the (user_id, story_id) primary key of story associations
+
+    Parameters:
+        user_id (string): ID of the User
+        story_ids (list): IDs of the stories
+
+    Returns:
+        vote_states (dict): Story IDs mapped to 'like' or 'dislike', stories the
+            User hasn't voted on are left out
+    """
+    story_ids = list(story_ids)
+    vote_states = {}
+    for i in range(0, len(story_ids), MAX_QUERY_IDS):
+        vote_states.update(
+            db.session.execute(
+                db.select(StoryAssociation.story_id, StoryAssociation.type).filter(
+                    StoryAssociation.user_id == user_id,
+                    StoryAssociation.story_id.in_(story_ids[i : i + MAX_QUERY_IDS]),
+                )
+            ).all()
+        )
+    return vote_states
+
+
 def edit_story(story_id, **kwargs):
     """
     Edit a story in the database
@@ -242,8 +550,13 @@ def edit_story(story_id, **kwargs):
         **kwargs (dict): A dict of which fields of a story to edit
     """
     story = query_story(story_id)
+    keywords = kwargs.get("keywords")
     story = db.session.merge(
-        Story(id=story_id, keywords=kwargs.get("keywords", story.keywords))
+        Story(
+            id=story_id,
+            keywords=story.keywords if keywords is None else keywords,
+            keywords_pending=story.keywords_pending and keywords is None,
+        )
     )
     db.session.add(story)
     db.session.commit()
@@ -259,6 +572,7 @@ def delete_story(story_id):
     # If a user has liked/disliked story
     if found_story_assoc := StoryAssociation.find_item_story_id(story_id):
         db.session.delete(found_story_assoc)
+    db.session.execute(db.delete(RankSnapshot).filter_by(story_id=story_id))
     db.session.delete(query_story(story_id))
     db.session.commit()
 
@@ -270,6 +584,17 @@ def delete_story(story_id):
 #####################################################
 
 
+def get_api_url():
+    """
+    Get the base url of the Hacker News API, which HN_API_URL can point at a
+    stand-in server
+
+    Returns:
+        url (string): The API base url without a trailing slash
+    """
+    return current_app.config.get("HN_API_URL", API_URL).rstrip("/")
+
+
 async def get_top_stories(count):
     """
     Get top stories from Hacker News API
@@ -280,48 +605,132 @@ async def get_top_stories(count):
     Returns:
         top_stories (list): A list of dictionaries with story information
     """
-    return await get_stories(
-        url="https://hacker-news.firebaseio.com/v0/topstories.json", count=count
-    )
+    return await get_stories(feed="top", count=count)
 
 
-async def get_stories(url, count):
+async def get_stories(feed, count, update=False):
     """
     Get stories from Hacker News API asynchronously
 
     Parameters:
-        url (string): The url to query Hacker News API with
+        feed (string): The feed to get stories from, a key of FEEDS
         count (int): Number of stories to get
+        update (bool): Determines whether to refetch stories already in the
+            database
 
     Returns:
         stories (list): A list of dictionaries with story information
     """
     tasks, stories = [], []
-    # 500 is the max items the Hacker News API returns
-    count = MAX_STORY_COUNT if count > MAX_STORY_COUNT else count
 
     # Fetch id's from Hacker News API
-    story_ids: list = requests.get(url, timeout=10).json()
-
-    async with aiohttp.ClientSession(
-        connector=aiohttp.TCPConnector(verify_ssl=False)
-    ) as client_session:
-        for story_id in story_ids[:count]:
-            story_found = Story.find_item(story_id)
-            if (story_found and UPDATE_DB) or not story_found:
-                # Create asyncio tasks made up of a coroutine
-                tasks.append(
-                    asyncio.create_task(
-                        async_fetch_item(
-                            client_session=client_session, item_id=story_id
-                        )
-                    )
-                )
-        # Run all tasks (coroutines) concurrently
-        stories = await asyncio.gather(*tasks)
+    client = get_client()
+    story_ids = (await get_feed_ids(feed=feed, client=client))[:count]
+
+    # One query for every ID instead of one per story
+    existing_ids = Story.find_existing_ids(story_ids)
+    for story_id in story_ids:
+        if update or story_id not in existing_ids:
+            # Create asyncio tasks made up of a coroutine
+            tasks.append(
+                asyncio.create_task(async_fetch_item(item_id=story_id, client=client))
+            )
+    # Run all tasks (coroutines) concurrently, bounded by the client
+    stories = await asyncio.gather(*tasks)
     return stories
 
 
+async def get_feed_ids(feed, client=None):
+    """
+    Get the ranked story IDs of a feed from Hacker News API asynchronously
+
+    Parameters:
+        feed (string): The feed to get story IDs from, a key of FEEDS
+        client (HackerNewsClient): Client to make the request with. Defaults
+            to the shared client
+
+    Returns:
+        story_ids (list): A list of story IDs in ranked order
+    """
+    client = client or get_client()
+    story_ids = await client.get_json(f"{get_api_url()}/{FEEDS[feed]}.json")
+    return story_ids or []
+
+
+async def get_feeds_ids(feeds):
+    """
+    Get the ranked story IDs of several feeds from Hacker News API
+    concurrently. Feeds that can't be fetched count as failed IDs, and the
+    refresh fails if none of them could be
+
+    Parameters:
+        feeds (list): A list of feeds to get story IDs from, keys of FEEDS
+
+    Returns:
+        feeds_ids (dict): The feed names mapped to their list of story IDs,
+            leaving out feeds that couldn't be fetched
+    """
+    global IDS_FAILED
+    client = get_client()
+    feeds_ids = await asyncio.gather(
+        *[get_feed_ids(feed=feed, client=client) for feed in feeds],
+        return_exceptions=True,
+    )
+    for feed_ids in feeds_ids:
+        if not isinstance(feed_ids, (list, CircuitOpenError, *FETCH_ERRORS)):
+            raise feed_ids
+    errors = [feed_ids for feed_ids in feeds_ids if not isinstance(feed_ids, list)]
+    IDS_FAILED += len(errors)
+    if errors and len(errors) == len(feeds_ids):
+        # Nothing to rank or ingest, so the refresh shouldn't count as done
+        raise errors[0]
+    return {
+        feed: feed_ids
+        for feed, feed_ids in zip(feeds, feeds_ids)
+        if isinstance(feed_ids, list)
+    }
+
+
+def get_ingest_feeds():
+    """
+    Get the feeds that are ingested, set with HN_FEEDS
+
+    Returns:
+        feeds (list): Keys of FEEDS, every feed by default
+
+    Raises:
+        ValueError: If HN_FEEDS has a feed that isn't a key of FEEDS
+    """
+    feeds = current_app.config.get("HN_FEEDS", list(FEEDS))
+    if unknown := [feed for feed in feeds if feed not in FEEDS]:
+        raise ValueError(
+            f"Unknown HN_FEEDS {', '.join(map(str, unknown))}, "
+            f"expected any of {', '.join(FEEDS)}"
+        )
+    return feeds
+
+
+async def get_ranked_story_ids():
+    """
+    Get the top MAX_STORY_COUNT story IDs of every ingested feed. A feed that
+    can't be fetched keeps its last ranking
+
+    Returns:
+        feeds_ids (dict): The feed names mapped to their list of story IDs
+        story_ids (list): Every story ID once, in the order first seen
+    """
+    with metrics_registry.timer("hn_ingest_phase_seconds", phase="feed_fetch"):
+        feeds_ids = await get_feeds_ids(get_ingest_feeds())
+    feeds_ids = {
+        feed: feed_ids[:MAX_STORY_COUNT] for feed, feed_ids in feeds_ids.items()
+    }
+    # Feeds overlap a lot, so each story is only fetched once
+    story_ids = list(
+        dict.fromkeys(story_id for ids in feeds_ids.values() for story_id in ids)
+    )
+    return feeds_ids, story_ids
+
+
 async def get_comments(story):
     """
     Get comments from Hacker News API asynchronously
@@ -332,142 +741,718 @@ async def get_comments(story):
     Returns:
         all_comments (list): A list of dictionaries with comment information
     """
-    all_comments = []
-    client_session = aiohttp.ClientSession()
+    all_comments = await get_comment_trees(stories=[story])
+    return all_comments[0]
 
-    # The first comment will be a story
-    async def fetch_comments(parent_comment):
-        tasks, comments = [], []
 
-        for comment_id in parent_comment["kids"]:
-            # Create asyncioz tasks made up of a coroutine
-            tasks.append(
-                asyncio.create_task(
-                    async_fetch_item(client_session=client_session, item_id=comment_id)
-                )
-            )
-        # Run all tasks (coroutines) concurrently
-        comments = await asyncio.gather(*tasks)
+async def get_comment_trees(stories):
+    """
+    Get the comment trees of many stories from Hacker News API asynchronously.
+    The trees are walked breadth first, so every unfetched comment at the same
+    depth across all stories is requested at once and a refresh takes about as
+    many round trips as the deepest thread
+
+    Parameters:
+        stories (list): A list of dictionaries representing stories
 
-        # Check and fetch child comments
+    Returns:
+        all_comments (list): A list for each story of dictionaries with comment
+            information, where 'kids' holds the nested child comments
+    """
+    client = get_client()
+    fetched_comments = {}
+
+    level_ids = [
+        comment_id for story in stories if story for comment_id in story.get("kids", [])
+    ]
+    start = time()
+    while level_ids:
+        # Run every fetch of this depth level concurrently, bounded by the client
+        comments = await asyncio.gather(
+            *[
+                async_fetch_item(item_id=comment_id, client=client)
+                for comment_id in level_ids
+            ]
+        )
+
+        level_ids = []
         for comment in comments:
-            if comment.get("kids"):
-                comment["kids"] = await fetch_comments(comment)
-        return comments
+            if comment and comment["id"] not in fetched_comments:
+                fetched_comments[comment["id"]] = comment
+                level_ids.extend(comment.get("kids", []))
+    metrics_registry.observe(
+        "hn_ingest_phase_seconds",
+        time() - start,
+        buckets=PHASE_BUCKETS,
+        phase="item_fetch",
+    )
 
-    if story.get("kids"):
-        all_comments = await fetch_comments(story)
-    await client_session.close()
+    # Rebuild the nested structure from the flat map of fetched comments
+    def build_tree(comment_ids):
+        tree = []
+        for comment_id in comment_ids:
+            if comment := fetched_comments.get(comment_id):
+                if comment.get("kids"):
+                    comment["kids"] = build_tree(comment["kids"])
+                tree.append(comment)
+        return tree
 
-    return all_comments
+    return [build_tree(story.get("kids", []) if story else []) for story in stories]
 
 
-async def async_fetch_item(client_session, item_id):
+async def get_items(item_ids):
     """
-    Get an item from Hacker News API asynchronously
+    Get many items from Hacker News API concurrently
 
     Parameters:
-        client_session (ClientSession): A ClientSession aiohttp object for making async requests
-        item_id (string): Item ID to query
+        item_ids (list): Item IDs to query
 
     Returns:
-        response (dict): A dictionary with the items information
+        items (list): A list of dictionaries with item information, leaving out
+            items that don't exist
     """
-    global IDS_QUERIED
-    IDS_QUERIED += 1
-    res = await client_session.get(
-        f"https://hacker-news.firebaseio.com/v0/item/{item_id}.json"
-    )
-    return await res.json()
+    client = get_client()
+    with metrics_registry.timer("hn_ingest_phase_seconds", phase="item_fetch"):
+        items = await asyncio.gather(
+            *[async_fetch_item(item_id=item_id, client=client) for item_id in item_ids]
+        )
+    return [item for item in items if item]
+
+
+async def get_updates():
+    """
+    Get the recently changed items and profiles from Hacker News API
 
+    Returns:
+        updates (dict): A dictionary with 'items' and 'profiles' lists
+    """
+    return await get_client().get_json(f"{get_api_url()}/updates.json") or {}
 
-def insert_stories_db(stories):
+
+async def async_fetch_item(item_id, client=None):
     """
-    Insert stories into the database
+    Get an item from Hacker News API asynchronously, or from the item cache if
+    it was fetched recently. Failed requests return None instead of failing the
+    whole refresh
 
     Parameters:
-        stories (list): A list of dictionaries with story information
+        item_id (string): Item ID to query
+        client (HackerNewsClient): Client to make the request with. Defaults
+            to the shared client
+
+    Returns:
+        response (dict): A dictionary with the items information, or None if it
+            couldn't be fetched
+    """
+    if item := item_cache.get(item_id):
+        metrics_registry.inc("hn_cache_lookups_total", cache="item", result="hit")
+        return item
+    metrics_registry.inc("hn_cache_lookups_total", cache="item", result="miss")
+
+    # Only counts requests that go out to the network
+    global IDS_QUERIED, IDS_FAILED
+    IDS_QUERIED += 1
+    client = client or get_client()
+    try:
+        item = await client.get_json(f"{get_api_url()}/item/{item_id}.json")
+    except (CircuitOpenError, *FETCH_ERRORS):
+        # A failed item is left out so the rest of the refresh is still saved
+        IDS_FAILED += 1
+        metrics_registry.inc("hn_api_items_total", result="failed")
+        return None
+    metrics_registry.inc("hn_api_items_total", result="fetched")
+    item_cache.set(item)
+    return item
+
+
+##############################################################
+#                                                            #
+# 'ingest_*' functions stream Hacker News API data into the  #
+# database                                                   #
+#                                                            #
+##############################################################
+
+
+async def ingest_stories(story_ids, comments=False, update=False):
+    """
+    Stream stories, and optionally their comment trees, from Hacker News API
+    into the database. Items go through fetch, normalize, keyword and write
+    stages connected by bounded queues, so memory stays flat however big the
+    threads are and database writes overlap with network requests.
+
+    Comment threads of stored stories are only walked when the story's
+    'descendants' differs from the stored 'num_comments'. Kids that aren't
+    stored yet are walked with their whole subtree, while stored comments are
+    only walked until as many new comments as the thread grew by are found
+
+    Parameters:
+        story_ids (list): Story IDs in ranked order
+        comments (bool): Determines whether to ingest comments
+        update (bool): Determines whether to refetch and update stories already
+            in the database
+
+    Returns:
+        counts (dict): Number of 'stories' and 'comments' written
     """
-    # Guarantees order of stories is correct
-    num_story_rows = db.session.query(Story).count()
-    kw_model = KeyBERT()
-    for num, story in enumerate(stories[::-1]):
-        found_story = Story.find_item(story["id"])
-        if not found_story:
-            keywords_list = kw_model.extract_keywords(story.get("title", ""))
-            keywords = " ".join([keyword[0] for keyword in keywords_list])
-            found_story = Story(
-                id=story.get("id"),
-                title=story.get("title"),
-                score=story.get("score"),
-                time=story.get("time"),
-                author=story.get("by"),
-                url=story.get("url", ""),
-                order_num=num + num_story_rows,
-                num_comments=story.get("descendants", 0),
-                keywords=keywords,
+    app = current_app._get_current_object()
+    client = get_client()
+    counts = {"stories": 0, "comments": 0}
+
+    existing_ids = Story.find_existing_ids(story_ids)
+    synced_counts = get_synced_comment_counts(existing_ids) if comments else {}
+    # New comments still to be found in each changed thread of a stored story
+    unfound = {}
+    fetched_story_ids = []
+    failed_before = IDS_FAILED
+    # Time with at least one request in flight, the item_fetch phase, which
+    # leaves out fetchers waiting on the later stages
+    fetching = {"requests": 0, "since": 0.0, "seconds": 0.0}
+
+    # IDs are small, so only queues holding items are bounded
+    id_queue = asyncio.Queue()
+    item_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    row_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    write_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+
+    for story_id in story_ids:
+        if update or story_id not in existing_ids:
+            id_queue.put_nowait((story_id, "story", None, story_id in existing_ids))
+
+    async def walk_kids(item, item_type, thread, stored):
+        # 'thread' is the stored story whose changed thread the item is in, and
+        # 'stored' is whether the item was in the database before this refresh
+        kids = item.get("kids", [])
+        kid_type = "root" if item_type == "story" else "child"
+        if item_type == "story" and stored:
+            grown = item.get("descendants", 0) - synced_counts[item["id"]]
+            if not grown:
+                return
+            # A thread that shrank had comments removed anywhere in it
+            thread = item["id"]
+            unfound[thread] = grown if grown > 0 else inf
+
+        if not stored:
+            # Everything below a new item is new too
+            if thread:
+                unfound[thread] -= len(kids)
+            for kid in kids:
+                id_queue.put_nowait((kid, kid_type, thread, False))
+        elif unfound[thread] > 0:
+            stored_kids = await asyncio.to_thread(
+                run_in_app_context, app, Comment.find_existing_ids, kids
             )
-        elif found_story and UPDATE_DB:
-            found_story = db.session.merge(
-                Story(
-                    id=story.get("id"),
-                    score=story.get("score"),
-                    order_num=num + num_story_rows,
-                    num_comments=story.get("descendants", 0),
+            unfound[thread] -= len(kids) - len(stored_kids)
+            for kid in kids:
+                id_queue.put_nowait((kid, kid_type, thread, kid in stored_kids))
+
+    async def fetch():
+        while True:
+            item_id, item_type, thread, stored = await id_queue.get()
+            try:
+                if not fetching["requests"]:
+                    fetching["since"] = time()
+                fetching["requests"] += 1
+                try:
+                    item = await async_fetch_item(item_id=item_id, client=client)
+                finally:
+                    fetching["requests"] -= 1
+                    if not fetching["requests"]:
+                        fetching["seconds"] += time() - fetching["since"]
+                if item:
+                    if comments:
+                        await walk_kids(item, item_type, thread, stored)
+                    if item_type == "story":
+                        fetched_story_ids.append(item_id)
+                    # Waits here when the later stages fall behind
+                    await item_queue.put((item, item_type))
+            finally:
+                id_queue.task_done()
+
+    async def normalize():
+        while (entry := await item_queue.get()) is not None:
+            item, item_type = entry
+            if item_type == "story":
+                await row_queue.put(("story", make_story_row(item)))
+            else:
+                await row_queue.put(("comment", make_comment_row(item, item_type)))
+        await row_queue.put(None)
+
+    async def add_keywords():
+        done = False
+        while not done:
+            entries = await get_batch(row_queue)
+            done = entries[-1] is None
+            entries = [entry for entry in entries if entry]
+            story_rows = [row for kind, row in entries if kind == "story"]
+            if story_rows:
+                await asyncio.to_thread(
+                    run_in_app_context, app, add_cached_keywords, story_rows
                 )
+            for entry in entries:
+                await write_queue.put(entry)
+        await write_queue.put(None)
+
+    async def write():
+        done = False
+        while not done:
+            entries = await get_batch(write_queue)
+            done = entries[-1] is None
+            rows = {"story": [], "comment": []}
+            for kind, row in filter(None, entries):
+                rows[kind].append(row)
+            await asyncio.to_thread(
+                run_in_app_context,
+                app,
+                write_rows,
+                rows["story"],
+                rows["comment"],
+                update,
             )
-        db.session.add(found_story)
-    db.session.commit()
+            counts["stories"] += len(rows["story"])
+            counts["comments"] += len(rows["comment"])
+            if rows["story"]:
+                # Keywords of this batch are extracted while the rest is ingested
+                start_keyword_extraction(app)
+
+    fetchers = [asyncio.create_task(fetch()) for _ in range(client.concurrency)]
+    stages = [
+        asyncio.create_task(stage()) for stage in (normalize, add_keywords, write)
+    ]
+    joined = asyncio.create_task(id_queue.join())
+    try:
+        # Fetchers and stages only finish before every ID is fetched by failing
+        done, _ = await asyncio.wait(
+            [joined, *fetchers, *stages], return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            task.result()
+        await item_queue.put(None)
+        await asyncio.gather(*stages)
+    finally:
+        for task in [joined, *fetchers, *stages]:
+            task.cancel()
+        metrics_registry.observe(
+            "hn_ingest_phase_seconds",
+            fetching["seconds"],
+            buckets=PHASE_BUCKETS,
+            phase="item_fetch",
+        )
+    # A thread with a failed comment is walked again by the next refresh
+    if comments and IDS_FAILED == failed_before:
+        mark_comments_synced(fetched_story_ids)
+    return counts
+
+
+async def get_batch(queue):
+    """
+    Get up to INGEST_BATCH_SIZE entries from a queue, waiting only for the first
+
+    Parameters:
+        queue (Queue): An asyncio queue that ends with None
+
+    Returns:
+        entries (list): Entries taken from the queue, ending with None if the
+            queue is finished
+    """
+    entries = [await queue.get()]
+    while entries[-1] is not None and len(entries) < INGEST_BATCH_SIZE:
+        try:
+            entries.append(queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return entries
+
+
+def run_in_app_context(app, func, *args):
+    """
+    Call a function inside its own app context, which gives it a database
+    session of its own when run on another thread
+
+    Parameters:
+        app: Flask app object
+        func (function): The function to call
+        *args: Arguments to call the function with
+
+    Returns:
+        The function's return value
+    """
+    with app.app_context():
+        return func(*args)
+
+
+def write_rows(story_rows, comment_rows, update=False):
+    """
+    Upsert a batch of story and comment rows in one transaction
+
+    Parameters:
+        story_rows (list): A list of story rows from make_story_row()
+        comment_rows (list): A list of comment rows from make_comment_row()
+        update (bool): Determines whether to update stories already in the
+            database
+    """
+    with db_write_timer():
+        record_rows("stories", upsert_stories(story_rows, update=update))
+        record_rows("comments", upsert_comments(comment_rows))
+        db.session.commit()
+
+
+def insert_stories_db(stories, update=False):
+    """
+    Insert stories into the database, updating existing ones when update is
+    set. Every story is written in one bulk upsert. New stories get their
+    keywords from the keyword cache, and misses are left pending for the
+    keyword extraction stage
+
+    Parameters:
+        stories (list): A list of dictionaries with story information
+        update (bool): Determines whether to update stories already in the
+            database
+    """
+    rows = [make_story_row(story) for story in stories if story]
+    add_cached_keywords(rows)
+
+    with db_write_timer():
+        record_rows("stories", upsert_stories(rows, update=update))
+        db.session.commit()
 
 
 def insert_comments_db(comments):
     """
-    Insert comments into the database
+    Insert comments into the database, updating the text and dead/deleted flags
+    of existing ones. The comment trees are flattened and written in one bulk
+    upsert
 
     Parameters:
-        comments (list): A list of dictionaries with comment information
+        comments (list): A list of lists of dictionaries with comment
+            information, each the top of a comment tree
     """
+    # The top of a tree is a root comment when its parent is a story, otherwise
+    # it's a reply added to a thread that's already stored
+    story_ids = Story.find_existing_ids(
+        [
+            comment.get("parent")
+            for root_comments in comments
+            for comment in root_comments
+        ]
+    )
 
-    def insert_child_comments(parent_comment, parent_comment_object):
-        for comment in parent_comment["kids"]:
-            # Doesn't update comment information
-            # (SQLAlchemy's merge function is giving issues)
-            found_comment = Comment.find_item(comment["id"])
-            if not comment.get("dead", False) and not found_comment:
-                comment_object = Comment(
-                    id=comment.get("id"),
-                    time=comment.get("time"),
-                    author=comment.get("by"),
-                    text=comment.get("text"),
-                    type="child",
-                    parent_comment=parent_comment_object,
+    rows = []
+    for root_comments in comments:
+        # Parents are always added before their kids
+        level = [
+            (comment, "root" if comment.get("parent") in story_ids else "child")
+            for comment in root_comments
+        ]
+        while level:
+            next_level = []
+            for comment, comment_type in level:
+                rows.append(make_comment_row(comment, comment_type=comment_type))
+                next_level.extend((kid, "child") for kid in comment.get("kids", []))
+            level = next_level
+
+    with db_write_timer():
+        record_rows("comments", upsert_comments(rows))
+        db.session.commit()
+
+
+def make_story_row(story):
+    """
+    Convert a story from Hacker News API into a row of the stories table
+
+    Parameters:
+        story (dict): A dictionary with story information
+
+    Returns:
+        row (dict): A value for every column written on insert
+    """
+    return {
+        "id": story["id"],
+        "title": story.get("title"),
+        "score": story.get("score"),
+        "time": story.get("time"),
+        "author": story.get("by"),
+        "url": story.get("url", ""),
+        "num_comments": story.get("descendants", 0),
+        # Filled in by add_cached_keywords or the keyword extraction stage,
+        # existing stories keep theirs on update
+        "keywords": "",
+        "keywords_pending": True,
+        "dead": story.get("dead", False),
+        "deleted": story.get("deleted", False),
+    }
+
+
+def make_comment_row(comment, comment_type):
+    """
+    Convert a comment from Hacker News API into a row of the comments table
+
+    Parameters:
+        comment (dict): A dictionary with comment information
+        comment_type (string): 'root' if the comment's parent is a story,
+            otherwise 'child'
+
+    Returns:
+        row (dict): A value for every column written on insert
+    """
+    return {
+        "id": comment["id"],
+        "time": comment.get("time"),
+        "author": comment.get("by"),
+        "text": comment.get("text"),
+        "type": comment_type,
+        "story_id": comment.get("parent") if comment_type == "root" else None,
+        "parent_comment_id": comment.get("parent") if comment_type == "child" else None,
+        "dead": comment.get("dead", False),
+        "deleted": comment.get("deleted", False),
+    }
+
+
+def add_cached_keywords(rows):
+    """
+    Fill in the keywords of story rows that aren't in the database yet from the
+    keyword cache. Only misses are left pending for the model
+
+    Parameters:
+        rows (list): A list of story rows from make_story_row()
+    """
+    existing_ids = Story.find_existing_ids([row["id"] for row in rows])
+    cached_keywords = keyword_cache.get_many(
+        [row["title"] or "" for row in rows if row["id"] not in existing_ids]
+    )
+    for row in rows:
+        if (row["title"] or "") in cached_keywords:
+            row["keywords"] = cached_keywords[row["title"] or ""]
+            row["keywords_pending"] = False
+
+
+@contextmanager
+def record_refresh(mode):
+    """
+    Record how long the refresh inside the 'with' statement takes and whether it
+    finished, then flush the metrics so every worker can report them
+
+    Parameters:
+        mode (string): 'full' or 'delta'
+    """
+    start, result = time(), "failure"
+    try:
+        yield
+        result = "success"
+        metrics_registry.set(
+            "hn_refresh_last_success_timestamp_seconds", time(), mode=mode
+        )
+    finally:
+        metrics_registry.inc("hn_refreshes_total", mode=mode, result=result)
+        metrics_registry.set("hn_refresh_duration_seconds", time() - start, mode=mode)
+        metrics_registry.set(
+            "hn_cache_hit_ratio", item_cache.stats()["hit_rate"], cache="item"
+        )
+        metrics_registry.flush()
+
+
+@contextmanager
+def db_write_timer():
+    """
+    Time the database write inside the 'with' statement, adding it to
+    DB_WRITE_TIME and the 'db_write' phase metric
+    """
+    global DB_WRITE_TIME
+    start = time()
+    try:
+        yield
+    finally:
+        DB_WRITE_TIME += time() - start
+        metrics_registry.observe(
+            "hn_ingest_phase_seconds",
+            time() - start,
+            buckets=PHASE_BUCKETS,
+            phase="db_write",
+        )
+
+
+def record_rows(table, counts):
+    """
+    Count the rows an upsert inserted and updated
+
+    Parameters:
+        table (string): Name of the table written to
+        counts (dict): Number of rows 'inserted' and 'updated'
+    """
+    for operation, count in counts.items():
+        metrics_registry.inc(
+            "hn_db_rows_total", count, table=table, operation=operation
+        )
+
+
+def save_rank_snapshot(feeds_ids):
+    """
+    Add the ranking of each fetched feed to the rank snapshots, with the score
+    and comment count every story has now, then prune the snapshots older than
+    RANK_SNAPSHOT_RETENTION seconds. Stories that aren't in the database, such
+    as ones that failed to fetch, are left out of the ranking
+
+    Parameters:
+        feeds_ids (dict): The feed names mapped to their list of story IDs
+    """
+    if not feeds_ids:
+        return
+    story_ids = list({story_id for ids in feeds_ids.values() for story_id in ids})
+    stories = {}
+    for i in range(0, len(story_ids), MAX_QUERY_IDS):
+        stories.update(
+            (story.id, story)
+            for story in db.session.execute(
+                db.select(Story.id, Story.score, Story.num_comments).filter(
+                    Story.id.in_(story_ids[i : i + MAX_QUERY_IDS])
                 )
-                db.session.add(comment_object)
+            )
+        )
+
+    with db_write_timer():
+        fetch = RankFetch(fetched_at=int(time()))
+        db.session.add(fetch)
+        db.session.flush()
+        rows = [
+            {
+                "feed": feed,
+                "fetch_id": fetch.id,
+                "rank": rank,
+                "story_id": story_id,
+                "score": stories[story_id].score,
+                "descendants": stories[story_id].num_comments,
+            }
+            for feed, feed_ids in feeds_ids.items()
+            for rank, story_id in enumerate(feed_ids, start=1)
+            if story_id in stories
+        ]
+        if rows:
+            db.session.execute(db.insert(RankSnapshot), rows)
+        prune_rank_snapshots()
+        db.session.commit()
+
+
+def prune_rank_snapshots():
+    """
+    Delete the rank snapshots older than RANK_SNAPSHOT_RETENTION seconds,
+    keeping the latest snapshot of every feed however old it is. The caller
+    commits
+    """
+    retention = current_app.config.get(
+        "RANK_SNAPSHOT_RETENTION", RANK_SNAPSHOT_RETENTION
+    )
+    cutoff_id = db.session.scalar(
+        db.select(db.func.max(RankFetch.id)).filter(
+            RankFetch.fetched_at < time() - retention
+        )
+    )
+    if cutoff_id is None:
+        return
+
+    for feed, latest_id in db.session.execute(
+        db.select(RankSnapshot.feed, db.func.max(RankSnapshot.fetch_id)).group_by(
+            RankSnapshot.feed
+        )
+    ).all():
+        db.session.execute(
+            db.delete(RankSnapshot)
+            .filter(
+                RankSnapshot.feed == feed,
+                RankSnapshot.fetch_id <= cutoff_id,
+                RankSnapshot.fetch_id != latest_id,
+            )
+            .execution_options(synchronize_session=False)
+        )
+    db.session.execute(
+        db.delete(RankFetch)
+        .filter(
+            RankFetch.id <= cutoff_id,
+            ~db.select(RankSnapshot.fetch_id)
+            .filter(RankSnapshot.fetch_id == RankFetch.id)
+            .exists(),
+        )
+        .execution_options(synchronize_session=False)
+    )
 
-                if comment.get("kids"):
-                    insert_child_comments(
-                        parent_comment=comment,
-                        parent_comment_object=comment_object,
-                    )
 
-    for root_comments in comments:
-        for root_comment in root_comments:
-            # Doesn't update comment information
-            # (SQLAlchemy's merge function is giving issues)
-            found_comment = Comment.find_item(root_comment["id"])
-            if not root_comment.get("dead", False) and not found_comment:
-                comment_object = Comment(
-                    id=root_comment.get("id"),
-                    time=root_comment.get("time"),
-                    author=root_comment.get("by"),
-                    text=root_comment.get("text"),
-                    type="root",
-                    story=Story.find_item(root_comment["parent"]),
+def get_synced_comment_counts(story_ids):
+    """
+    Get the number of comments stored stories had when their comments were last
+    synced. Stories whose comments were never synced count as having none
+
+    Parameters:
+        story_ids (iterable): IDs of stories in the database
+
+    Returns:
+        counts (dict): The story IDs mapped to their 'synced_comments'
+    """
+    story_ids = list(story_ids)
+    counts = {}
+    for i in range(0, len(story_ids), MAX_QUERY_IDS):
+        counts.update(
+            db.session.execute(
+                db.select(Story.id, Story.synced_comments).filter(
+                    Story.id.in_(story_ids[i : i + MAX_QUERY_IDS])
                 )
-                if root_comment.get("kids"):
-                    insert_child_comments(
-                        parent_comment=root_comment,
-                        parent_comment_object=comment_object,
-                    )
-                db.session.add(comment_object)
+            ).all()
+        )
+    return {story_id: count or 0 for story_id, count in counts.items()}
+
+
+def mark_comments_synced(story_ids):
+    """
+    Record that the comments of stories are synced up to their current
+    'num_comments'
+
+    Parameters:
+        story_ids (list): IDs of stories whose comments were synced
+    """
+    story_ids = list(story_ids)
+    for i in range(0, len(story_ids), MAX_QUERY_IDS):
+        db.session.execute(
+            db.update(Story)
+            .filter(Story.id.in_(story_ids[i : i + MAX_QUERY_IDS]))
+            .values(synced_comments=Story.num_comments)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+
+
+def get_sync_checkpoint(scope="stories"):
+    """
+    Get the checkpoint saved by the last sync with Hacker News API
+
+    Parameters:
+        scope (string): 'stories' for any sync, 'comments' for syncs that
+            included comments
+
+    Returns:
+        checkpoint (dict): The Unix 'time' of the last sync, or None if there
+            hasn't been one
+    """
+    setting = WebsiteSetting.find_item(f"sync_{scope}_time")
+    if not setting:
+        return None
+    return {"time": float(setting.status)}
+
+
+def save_sync_checkpoint(comments=False):
+    """
+    Save the checkpoint of a finished sync with Hacker News API
+
+    Parameters:
+        comments (bool): Whether the sync included comments
+    """
+    sync_time = time()
+    for scope in ["stories", "comments"] if comments else ["stories"]:
+        db.session.merge(WebsiteSetting(id=f"sync_{scope}_time", status=str(sync_time)))
+    db.session.commit()
+
+
+def clear_sync_checkpoint():
+    """
+    Remove every sync checkpoint so the next sync is a full refresh
+    """
+    db.session.execute(
+        db.delete(WebsiteSetting).filter(WebsiteSetting.id.like("sync_%"))
+    )
     db.session.commit()
@@ -0,0 +1,274 @@
+"""
+Refreshes from the Hacker News API run as background jobs. Submitting a
+refresh returns right away, and a request for a refresh that is already queued
+or running joins that job instead of starting another. Jobs are recorded in
+the database so any worker process can report their progress, and a lock file
+keeps refreshes in different worker processes from overlapping. Besides full
+or delta refreshes of stories and comments there are 'hot' refreshes, which
+only refetch the stories adaptive scheduling marked hot, and 'retention' jobs,
+which archive old stories and run under the same lock so they don't slow a
+refresh down
+
+Methods:
+    submit_refresh(kind)
+    get_refresh_job(job_id)
+    serialize_refresh_job(job)
+    run_refresh_job(app, job_id, kind)
+    refresh_lock()
+    release_abandoned_jobs()
+    get_executor()
+
+Variables:
+    JOB_KINDS
+    DEFAULT_LOCK_PATH
+    DEFAULT_JOB_TIMEOUT
+    PROGRESS_INTERVAL
+    JOB_HISTORY
+"""
+
+import asyncio
+import fcntl
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import time
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from ..db import db, RefreshJob
+from . import news_api, adaptive_schedule, retention
+from .item_cache import item_cache
+
+# Each kind of job mapped to the kinds whose jobs also do its work
+JOB_KINDS = {
+    "comments": ["comments"],
+    "stories": ["comments", "stories"],
+    "hot": ["comments", "stories", "hot"],
+    "retention": ["retention"],
+}
+DEFAULT_LOCK_PATH = "hacker_news/db/refresh.lock"
+# Seconds before a job that never finished, such as one whose worker was
+# killed, stops blocking new jobs
+DEFAULT_JOB_TIMEOUT = 1800
+# Seconds between saves of a running job's progress
+PROGRESS_INTERVAL = 1
+# Finished jobs kept for the status endpoint and the API request budget, enough
+# for an hour of hot refreshes
+JOB_HISTORY = 200
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Get the executor refresh jobs run on, starting it on first use. It has a
+    single thread, so jobs submitted to one process run one after another
+
+    Returns:
+        executor (ThreadPoolExecutor): The executor
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refresh")
+        return _executor
+
+
+def submit_refresh(kind="stories", on_finished=None):
+    """
+    Submit a refresh to run in the background, or join the one in flight. A
+    refresh with comments also refreshes stories, and either refreshes the hot
+    stories, so a request joins any job listed for its kind in JOB_KINDS
+
+    Parameters:
+        kind (string): 'stories', 'comments' to refresh comments as well,
+            'hot' to only refresh the hot stories, or 'retention' to archive
+            old stories
+        on_finished (function): Called without arguments on the executor's
+            thread once a job submitted here finishes. Not called for a joined
+            job, which may be running in another process
+
+    Returns:
+        job (RefreshJob): The submitted or joined job
+        joined (bool): Whether an in flight job was joined
+    """
+    app = current_app._get_current_object()
+    release_abandoned_jobs()
+    kinds = JOB_KINDS[kind]
+
+    while True:
+        if job := db.session.scalars(
+            db.select(RefreshJob).filter(RefreshJob.active_kind.in_(kinds))
+        ).first():
+            return job, True
+
+        job = RefreshJob(
+            id=uuid.uuid4().hex,
+            kind=kind,
+            status="queued",
+            active_kind=kind,
+            submitted_at=time(),
+        )
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker process submitted the same kind of job first
+            db.session.rollback()
+            continue
+        future = get_executor().submit(run_refresh_job, app, job.id, kind)
+        if on_finished:
+            future.add_done_callback(lambda _: on_finished())
+        return job, False
+
+
+def get_refresh_job(job_id):
+    """
+    Get a refresh job
+
+    Parameters:
+        job_id (string): ID of the job
+
+    Returns:
+        job (RefreshJob): The job, or None if it doesn't exist
+    """
+    return RefreshJob.find_item(job_id)
+
+
+def serialize_refresh_job(job):
+    """
+    Convert a refresh job into a JSON serializable dict
+
+    Parameters:
+        job (RefreshJob): The job
+
+    Returns:
+        job (dict): The job's fields and how long it has run in 'duration'
+    """
+    duration = None
+    if job.started_at:
+        duration = (job.finished_at or time()) - job.started_at
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "submitted_at": job.submitted_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "duration": duration,
+        "items_queried": job.items_queried,
+        "items_failed": job.items_failed,
+        "error": job.error,
+    }
+
+
+def run_refresh_job(app, job_id, kind):
+    """
+    Run a refresh job on the executor's thread, once no other process is
+    refreshing. Refreshes that fetched the feeds are measured for adaptive
+    scheduling
+
+    Parameters:
+        app: Flask app object
+        job_id (string): ID of the job
+        kind (string): 'stories', 'comments', 'hot' or 'retention'
+    """
+    with app.app_context(), refresh_lock():
+        _update_job(job_id, status="running", started_at=time())
+        queried, failed = news_api.IDS_QUERIED, news_api.IDS_FAILED
+
+        def get_progress():
+            return {
+                "items_queried": news_api.IDS_QUERIED - queried,
+                "items_failed": news_api.IDS_FAILED - failed,
+            }
+
+        async def run():
+            if kind == "hot":
+                refresh = adaptive_schedule.refresh_hot_stories()
+            elif kind == "retention":
+                refresh = asyncio.to_thread(
+                    news_api.run_in_app_context, app, retention.apply_retention
+                )
+            else:
+                refresh = news_api.update_data(comments=kind == "comments")
+            task = asyncio.create_task(refresh)
+            while not task.done():
+                await asyncio.wait({task}, timeout=PROGRESS_INTERVAL)
+                _update_job(job_id, **get_progress())
+            task.result()
+
+        try:
+            asyncio.run(run())
+        except Exception as error:
+            # Rows the failed refresh left staged are never committed
+            db.session.rollback()
+            _finish_job(job_id, "failed", error=repr(error), **get_progress())
+            print(f"Refresh job {job_id} failed: {error!r}")
+            return
+        job = _finish_job(job_id, "succeeded", **get_progress())
+        duration = job.finished_at - job.started_at
+        print(f"Updated data from API in {round(duration, 3)} seconds")
+        print(f"Item cache hit rate {item_cache.stats()['hit_rate']:.1%}")
+        if kind in ["stories", "comments"]:
+            adaptive_schedule.record_activity()
+
+
+@contextmanager
+def refresh_lock():
+    """
+    Hold the lock file set by REFRESH_LOCK_PATH for the block inside the 'with'
+    statement, waiting for any other process that holds it
+    """
+    path = current_app.config.get("REFRESH_LOCK_PATH", DEFAULT_LOCK_PATH)
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def release_abandoned_jobs():
+    """
+    Mark jobs in flight for longer than REFRESH_JOB_TIMEOUT as failed, so a
+    worker killed mid refresh doesn't block refreshes forever
+    """
+    timeout = current_app.config.get("REFRESH_JOB_TIMEOUT", DEFAULT_JOB_TIMEOUT)
+    db.session.execute(
+        db.update(RefreshJob)
+        .filter(
+            RefreshJob.active_kind.is_not(None),
+            db.func.coalesce(RefreshJob.started_at, RefreshJob.submitted_at)
+            < time() - timeout,
+        )
+        .values(status="failed", active_kind=None, error="abandoned")
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _update_job(job_id, **values):
+    # Written on a connection of its own, so a progress update in the middle of
+    # a refresh never commits rows the refresh has staged in db.session
+    with db.engine.begin() as connection:
+        connection.execute(db.update(RefreshJob).filter_by(id=job_id).values(**values))
+
+
+def _finish_job(job_id, status, **values):
+    _update_job(job_id, status=status, active_kind=None, finished_at=time(), **values)
+    # Only the most recent finished jobs are kept
+    with db.engine.begin() as connection:
+        connection.execute(
+            db.delete(RefreshJob).filter(
+                RefreshJob.id.in_(
+                    db.select(RefreshJob.id)
+                    .filter(RefreshJob.active_kind.is_(None))
+                    .order_by(RefreshJob.submitted_at.desc())
+                    .offset(JOB_HISTORY)
+                )
+            )
+        )
+    # The session may still hold the job as it was loaded before the updates
+    return db.session.get(RefreshJob, job_id, populate_existing=True)
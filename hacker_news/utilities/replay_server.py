@@ -0,0 +1,259 @@
+"""
+A local stand-in for the Hacker News API that serves recorded or synthetic
+item trees, with adjustable latency and error injection. Point HN_API_URL at
+it to benchmark or test ingestion without reaching firebaseio.com
+
+Classes:
+    ReplayServer
+
+Methods:
+    make_synthetic_fixtures(stories, depth, fanout, seed)
+    record_fixtures(path, count)
+"""
+
+import asyncio
+import json
+import random
+import threading
+from time import time
+from aiohttp import web
+from .hn_client import close_client
+from .news_api import FEEDS, get_feed_ids, get_items, get_comment_trees
+
+
+class ReplayServer:
+    """
+    Serves the feed, item, 'updates' and 'maxitem' endpoints of the Hacker
+    News API from fixtures
+
+    Attributes:
+        fixtures: A dict with 'feeds' (endpoint name to story IDs) and 'items'
+            (item ID to item)
+        latency: Mean seconds each response is delayed
+        latency_jitter: Standard deviation of the delay in seconds
+        error_rate: Fraction of item requests answered with a 503
+        host: Host the server listens on
+        port: Port the server listens on, 0 picks a free one
+        requests: Number of requests served
+
+    Methods:
+        start(self): Start serving on a background thread
+        stop(self): Stop the server
+        serve_forever(self): Serve on the current thread until interrupted
+        set_item(self, item): Add or replace a served item
+    """
+
+    def __init__(
+        self,
+        fixtures,
+        latency=0.0,
+        latency_jitter=0.0,
+        error_rate=0.0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._items = {int(id): item for id, item in fixtures["items"].items()}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/v0"
+
+    def set_item(self, item):
+        """
+        Add or replace a served item, such as to change a story between
+        refreshes
+
+        Parameters:
+            item (dict): The item, served at its 'id'
+        """
+        self._items[int(item["id"])] = item
+
+    def _make_app(self):
+        app = web.Application()
+        app.router.add_get("/v0/item/{item_id}.json", self._handle_item)
+        app.router.add_get("/v0/updates.json", self._handle_updates)
+        app.router.add_get("/v0/maxitem.json", self._handle_max_item)
+        app.router.add_get("/v0/{feed}.json", self._handle_feed)
+        return app
+
+    async def _delay(self):
+        self.requests += 1
+        if self.latency or self.latency_jitter:
+            await asyncio.sleep(max(random.gauss(self.latency, self.latency_jitter), 0))
+
+    async def _handle_item(self, request):
+        await self._delay()
+        if random.random() < self.error_rate:
+            return web.Response(status=503)
+        item = self._items.get(int(request.match_info["item_id"]))
+        return web.json_response(item)
+
+    async def _handle_feed(self, request):
+        await self._delay()
+        feed_ids = self.fixtures["feeds"].get(request.match_info["feed"])
+        if feed_ids is None:
+            raise web.HTTPNotFound()
+        return web.json_response(feed_ids)
+
+    async def _handle_updates(self, request):
+        await self._delay()
+        return web.json_response(
+            self.fixtures.get("updates", {"items": [], "profiles": []})
+        )
+
+    async def _handle_max_item(self, request):
+        await self._delay()
+        return web.json_response(max(self._items, default=0))
+
+    async def _start_site(self):
+        self._runner = web.AppRunner(self._make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Resolve the port picked by the OS when port is 0
+        self.port = self._runner.addresses[0][1]
+
+    def start(self):
+        """
+        Start serving on a background thread
+
+        Returns:
+            url (string): Base url to set HN_API_URL to
+        """
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start_site())
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="replay-server", daemon=True
+        )
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        """
+        Stop the server started with start()
+        """
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def serve_forever(self):
+        """
+        Serve on the current thread until interrupted
+        """
+        web.run_app(self._make_app(), host=self.host, port=self.port, print=None)
+
+
+def make_synthetic_fixtures(stories=20, depth=3, fanout=4, seed=0):
+    """
+    Generate fixtures with random comment trees
+
+    Parameters:
+        stories (int): Number of stories in every feed
+        depth (int): Deepest level of comments below a story
+        fanout (int): Most replies any story or comment has
+        seed (int): Seed for the random generator, the same seed gives the
+            same fixtures
+
+    Returns:
+        fixtures (dict): Fixtures for ReplayServer
+    """
+    rng = random.Random(seed)
+    now = int(time())
+    items, story_ids = {}, []
+    next_id = 1
+
+    for rank in range(stories):
+        story = {
+            "id": next_id,
+            "type": "story",
+            "by": f"user{rng.randrange(1000)}",
+            "title": f"Synthetic story {rank} about {rng.choice(['rust', 'python', 'sqlite', 'startups', 'space'])}",
+            "score": rng.randrange(1, 1000),
+            "time": now - rank * 600,
+            "url": f"https://example.com/{next_id}",
+            "kids": [],
+            "descendants": 0,
+        }
+        items[story["id"]] = story
+        story_ids.append(story["id"])
+        next_id += 1
+
+        level = [story]
+        for _ in range(depth):
+            next_level = []
+            for parent in level:
+                for _ in range(rng.randint(0, fanout)):
+                    comment = {
+                        "id": next_id,
+                        "type": "comment",
+                        "by": f"user{rng.randrange(1000)}",
+                        "parent": parent["id"],
+                        "text": f"Synthetic comment {next_id}",
+                        "time": story["time"] + rng.randrange(1, 3600),
+                        "kids": [],
+                    }
+                    items[comment["id"]] = comment
+                    parent["kids"].append(comment["id"])
+                    next_level.append(comment)
+                    story["descendants"] += 1
+                    next_id += 1
+            level = next_level
+
+    return {
+        "feeds": {endpoint: story_ids for endpoint in FEEDS.values()},
+        "items": items,
+    }
+
+
+async def record_fixtures(path, count):
+    """
+    Record fixtures from the Hacker News API at HN_API_URL, with every story of
+    each feed and their full comment trees
+
+    Parameters:
+        path (string): File to write the fixtures to as JSON
+        count (int): Number of stories to record from each feed
+
+    Returns:
+        fixtures (dict): The recorded fixtures
+    """
+    feeds, items = {}, {}
+    try:
+        for feed, endpoint in FEEDS.items():
+            feeds[endpoint] = (await get_feed_ids(feed=feed))[:count]
+
+        story_ids = {story_id for ids in feeds.values() for story_id in ids}
+        stories = await get_items(list(story_ids))
+        comment_trees = await get_comment_trees(stories)
+    finally:
+        await close_client()
+
+    def add_tree(comments):
+        for comment in comments:
+            kids = comment.get("kids", [])
+            items[comment["id"]] = {**comment, "kids": [kid["id"] for kid in kids]}
+            add_tree(kids)
+
+    for story in stories:
+        items[story["id"]] = story
+    for comments in comment_trees:
+        add_tree(comments)
+
+    fixtures = {"feeds": feeds, "items": items}
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(fixtures, file)
+    return fixtures
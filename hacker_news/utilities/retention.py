@@ -0,0 +1,267 @@
+"""
+Retention of old stories. Stories older than RETENTION_DAYS that aren't ranked
+in any feed's rank snapshots, and that no retention policy keeps, are archived
+with their whole comment threads to gzipped JSON lines files, then deleted.
+Stories are moved in small batches, each deleted in its own short transaction,
+and the freed pages are given back to the file system with incremental vacuum
+in small steps, so refreshes and pages are never locked out for long
+
+Methods:
+    apply_retention()
+    find_expired_story_ids()
+    archive_stories(story_ids, path)
+    delete_stories(story_ids)
+    incremental_vacuum()
+    get_database_size()
+    apply_retention_command()
+    add_retention_command(app)
+
+Variables:
+    DEFAULT_RETENTION_DAYS
+    DEFAULT_ARCHIVE_PATH
+    RETENTION_BATCH_SIZE
+    VACUUM_STEP_PAGES
+"""
+
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+from time import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from ..db import (
+    db,
+    Story,
+    Comment,
+    RankSnapshot,
+    StoryAssociation,
+    MAX_QUERY_IDS,
+    convert_to_incremental_vacuum,
+)
+from .metrics import metrics_registry
+
+# Days stories are kept, RETENTION_DAYS overrides it and 0 keeps them forever
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_ARCHIVE_PATH = "hacker_news/db/archive"
+# Stories archived and deleted per transaction
+RETENTION_BATCH_SIZE = 200
+# Pages freed per incremental vacuum transaction
+VACUUM_STEP_PAGES = 1000
+
+
+def apply_retention():
+    """
+    Archive and delete the stories past retention, then vacuum the freed space
+
+    Returns:
+        report (dict): Number of 'stories', 'comments' and 'votes' archived,
+            the 'archive' file written to, and the bytes 'reclaimed' from the
+            database file
+    """
+    report = {"stories": 0, "comments": 0, "votes": 0, "archive": None}
+    size_before = get_database_size()
+    story_ids = find_expired_story_ids()
+    if story_ids:
+        archive_dir = current_app.config.get("ARCHIVE_PATH", DEFAULT_ARCHIVE_PATH)
+        os.makedirs(archive_dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        report["archive"] = os.path.join(archive_dir, f"stories-{stamp}.jsonl.gz")
+
+    for i in range(0, len(story_ids), RETENTION_BATCH_SIZE):
+        batch = story_ids[i : i + RETENTION_BATCH_SIZE]
+        # Written before the rows are deleted, so an interrupted run loses nothing
+        counts = archive_stories(batch, report["archive"])
+        delete_stories(batch)
+        for table, count in counts.items():
+            report[table] += count
+
+    incremental_vacuum()
+    report["reclaimed"] = max(size_before - get_database_size(), 0)
+
+    for table in ["stories", "comments", "votes"]:
+        metrics_registry.inc("hn_retention_rows_total", report[table], table=table)
+    metrics_registry.set("hn_retention_reclaimed_bytes", report["reclaimed"])
+    metrics_registry.set("hn_retention_last_run_timestamp_seconds", time())
+    metrics_registry.flush()
+    return report
+
+
+def find_expired_story_ids():
+    """
+    Find the stories past retention. Stories in a rank snapshot are kept, so
+    are stories users voted on unless RETENTION_KEEP_VOTED is off, and stories
+    scoring at least RETENTION_KEEP_SCORE if it's set
+
+    Returns:
+        story_ids (list): IDs of the stories to archive, oldest first
+    """
+    config = current_app.config
+    days = config.get("RETENTION_DAYS", DEFAULT_RETENTION_DAYS)
+    if not days:
+        return []
+
+    query = db.select(Story.id).filter(
+        Story.time < time() - days * 86400,
+        Story.id.not_in(db.select(RankSnapshot.story_id)),
+    )
+    if config.get("RETENTION_KEEP_VOTED", True):
+        query = query.filter(Story.id.not_in(db.select(StoryAssociation.story_id)))
+    if (min_score := config.get("RETENTION_KEEP_SCORE")) is not None:
+        query = query.filter(db.func.coalesce(Story.score, 0) < min_score)
+    return db.session.scalars(query.order_by(Story.time)).all()
+
+
+def archive_stories(story_ids, path):
+    """
+    Append stories to an archive, one JSON line per story holding its row, the
+    rows of every comment in its thread, and its votes
+
+    Parameters:
+        story_ids (list): IDs of the stories to archive
+        path (string): Path of the gzipped JSON lines file to append to
+
+    Returns:
+        counts (dict): Number of 'stories', 'comments' and 'votes' archived
+    """
+    stories = {
+        row["id"]: {"story": dict(row), "comments": [], "votes": []}
+        for row in db.session.execute(
+            db.select(Story.__table__).filter(Story.id.in_(story_ids))
+        ).mappings()
+    }
+
+    # Every comment of the threads, found by walking down from the root comments
+    thread = (
+        db.select(Comment.id, Comment.story_id.label("thread_story_id"))
+        .filter(Comment.story_id.in_(story_ids), Comment.type == "root")
+        .cte("thread", recursive=True)
+    )
+    thread = thread.union_all(
+        db.select(Comment.id, thread.c.thread_story_id).join(
+            thread, Comment.parent_comment_id == thread.c.id
+        )
+    )
+    for row in db.session.execute(
+        db.select(Comment.__table__, thread.c.thread_story_id).join(
+            thread, Comment.id == thread.c.id
+        )
+    ).mappings():
+        row = dict(row)
+        stories[row.pop("thread_story_id")]["comments"].append(row)
+
+    for row in db.session.execute(
+        db.select(StoryAssociation.__table__).filter(
+            StoryAssociation.story_id.in_(story_ids)
+        )
+    ).mappings():
+        stories[row["story_id"]]["votes"].append(dict(row))
+
+    with gzip.open(path, "at", encoding="utf-8") as archive:
+        for record in stories.values():
+            archive.write(json.dumps(record) + "\n")
+        archive.flush()
+        os.fsync(archive.fileno())
+    return {
+        "stories": len(stories),
+        "comments": sum(len(record["comments"]) for record in stories.values()),
+        "votes": sum(len(record["votes"]) for record in stories.values()),
+    }
+
+
+def delete_stories(story_ids):
+    """
+    Delete stories with their comment threads and votes in one transaction
+
+    Parameters:
+        story_ids (list): IDs of the stories to delete
+    """
+    thread = (
+        db.select(Comment.id)
+        .filter(Comment.story_id.in_(story_ids), Comment.type == "root")
+        .cte("thread", recursive=True)
+    )
+    thread = thread.union_all(
+        db.select(Comment.id).join(thread, Comment.parent_comment_id == thread.c.id)
+    )
+    comment_ids = db.session.scalars(db.select(thread.c.id)).all()
+    for i in range(0, len(comment_ids), MAX_QUERY_IDS):
+        db.session.execute(
+            db.delete(Comment)
+            .filter(Comment.id.in_(comment_ids[i : i + MAX_QUERY_IDS]))
+            .execution_options(synchronize_session=False)
+        )
+    for model in [StoryAssociation, RankSnapshot]:
+        db.session.execute(
+            db.delete(model)
+            .filter(model.story_id.in_(story_ids))
+            .execution_options(synchronize_session=False)
+        )
+    db.session.execute(
+        db.delete(Story)
+        .filter(Story.id.in_(story_ids))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def incremental_vacuum():
+    """
+    Give the database's free pages back to the file system, VACUUM_STEP_PAGES at
+    a time. Only does anything when the database uses incremental auto vacuum,
+    older databases are switched by 'flask db-upgrade'
+    """
+    with db.engine.connect() as connection:
+        # 2 is INCREMENTAL
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            return
+        while connection.exec_driver_sql("PRAGMA freelist_count").scalar():
+            # sqlite3's execute only steps the pragma once, freeing a single
+            # page, executescript runs it to the end in its own transaction
+            connection.connection.executescript(
+                f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})"
+            )
+
+
+def get_database_size():
+    """
+    Get the size of the database
+
+    Returns:
+        size (int): Size of the database file in bytes
+    """
+    with db.engine.connect() as connection:
+        page_count = connection.exec_driver_sql("PRAGMA page_count").scalar()
+        page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+    return page_count * page_size
+
+
+@click.command("apply-retention")
+@with_appcontext
+def apply_retention_command():
+    """
+    Function called from CLI command "Flask apply-retention". Databases
+    created before incremental vacuum are rebuilt first, since only then can
+    the space retention frees be given back
+    """
+    if convert_to_incremental_vacuum():
+        click.echo("* Rebuilt the database for incremental vacuum *")
+    report = apply_retention()
+    click.echo(
+        f"* Archived {report['stories']} stories, {report['comments']} comments"
+        f" and {report['votes']} votes *"
+    )
+    if report["archive"]:
+        click.echo(f"* Archive written to {report['archive']} *")
+    click.echo(f"* Reclaimed {report['reclaimed'] / 1024 ** 2:.1f} MiB *")
+
+
+def add_retention_command(app):
+    """
+    Called in app.py to add command to flask
+
+    Parameters:
+        app: Flask app object
+    """
+    app.cli.add_command(apply_retention_command)
@@ -4,5 +4,6 @@ Import module files
 from .admin import admin
 from .home import home
 from .login import login
+from .metrics import metrics
 from .profile import profile
 from .story import story
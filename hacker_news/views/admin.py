@@ -2,7 +2,6 @@
 Defines the routes for the admin pages
 
 Methods:
-    zip_stories(stories, type)
     set_current_user(endpoint, values)
     index()
 
@@ -10,43 +9,13 @@ Variables:
     admin
 """
 
-from flask import Blueprint, render_template, g
+from flask import Blueprint, render_template, g, request
 from flask_login import login_required, current_user
-from ..utilities import (
-    admin_required,
-    query_liked_stories,
-    query_disliked_stories,
-    query_story_association_by_id,
-)
-from ..db import User
+from ..utilities import admin_required, query_story_votes
+from ..db import read_only
 
 admin = Blueprint("admin", __name__, url_prefix="/admin")
 
-# * Similar functionality in profile.py, home.py
-def zip_stories(stories, type):
-    """
-    Removes duplicate stories, calculates which users liked/disliked a story
-    and zips them with their story
-
-    Parameters:
-        stories (list): An list of Story objects
-        type (string): Type of StoryAssociation to search for
-
-    Returns:
-        A zip object with tuples (story, [list of users])
-    """
-    stories = [*set(stories)]  # Removes duplicates
-    total_users = []
-    for story in stories:
-        if story_associations := query_story_association_by_id(story_id=story.id):
-            users = []
-            for story_assoc in story_associations:
-                if story_assoc.type == type:
-                    users.append(User.find_item(story_assoc.user_id))
-            total_users.append(users)
-
-    return zip(stories, total_users)
-
 
 @admin.url_value_preprocessor
 def set_current_user(endpoint, values):
@@ -61,17 +30,37 @@ def set_current_user(endpoint, values):
 
 
 @admin.route("/")
+@read_only
 @login_required
 @admin_required
 def index():
     """
-    Index route that shows Admin page
+    Index route that shows Admin page with a page of liked and a page of
+    disliked stories. Each list is paged with '?liked_after=' and
+    '?disliked_after=', the ID of the last story on its previous page
 
     Returns:
         Returns admin.html
     """
-    liked_stories = zip_stories(query_liked_stories(), type="like")
-    disliked_stories = zip_stories(query_disliked_stories(), type="dislike")
+    num_stories = 50
+    liked_after = request.args.get("liked_after", type=int)
+    disliked_after = request.args.get("disliked_after", type=int)
+
+    liked_stories = query_story_votes("like", after=liked_after, count=num_stories)
+    disliked_stories = query_story_votes(
+        "dislike", after=disliked_after, count=num_stories
+    )
     return render_template(
-        "admin.html", liked_stories=liked_stories, disliked_stories=disliked_stories
+        "admin.html",
+        liked_stories=liked_stories,
+        disliked_stories=disliked_stories,
+        liked_after=liked_after,
+        disliked_after=disliked_after,
+        # Only links to a next page when this one is full
+        next_liked_after=liked_stories[-1][0].id
+        if len(liked_stories) == num_stories
+        else None,
+        next_disliked_after=disliked_stories[-1][0].id
+        if len(disliked_stories) == num_stories
+        else None,
     )
@@ -2,53 +2,83 @@
 Defines the routes for the home page
 
 Methods:
-    zip_stories(stories, type)
+    zip_stories(stories, ranks)
     calculate_publish_time(timestamp)
     set_current_user(endpoint, values)
     index()
     update()
     update_comments()
+    update_status(job_id)
+    submitted_response(job, joined)
     logout()
 
 Variables:
+    FEED_TITLES
     home
 """
 
-import asyncio
 import os
 from time import time
 from urllib.parse import quote_plus, urlencode
-from flask import Blueprint, render_template, redirect, url_for, session, g
+from flask import (
+    Blueprint,
+    render_template,
+    redirect,
+    url_for,
+    session,
+    g,
+    request,
+    abort,
+    jsonify,
+)
 from flask_login import logout_user, current_user, login_required
-from ..utilities import query_top_stories, update_data, admin_required
+from ..utilities import (
+    query_feed_stories,
+    query_vote_states,
+    get_ingest_feeds,
+    submit_refresh,
+    get_refresh_job,
+    serialize_refresh_job,
+    admin_required,
+)
+from ..db import read_only
 
 home = Blueprint("home", __name__)
 
-# * Similar functionality in admin.py, profile.py
-def zip_stories(stories):
+# Tab titles of the feeds shown on the homepage
+FEED_TITLES = {
+    "top": "Top Stories",
+    "new": "New",
+    "best": "Best",
+    "ask": "Ask HN",
+    "show": "Show HN",
+    "job": "Jobs",
+}
+
+
+def zip_stories(stories, ranks=None):
     """
     Calculates a story order number, publish time, and like/dislike
     status and zips them with their story
 
     Parameters:
         stories (list): An list of Story objects
+        ranks (list): The order number of each story, defaults to counting
+            from 1
 
     Returns:
         A zip object with tuples (order number, story, publish time)
     """
-    publish_times, like_statuses = [], []
-    for story in stories:
-        publish_times.append(calculate_publish_time(story.time))
-        if current_user.is_authenticated:
-            liked_story = current_user.has_liked_story(story.id)
-            if liked_story:
-                like_statuses.append(liked_story.type)
-            else:
-                like_statuses.append(None)
-        else:
-            like_statuses.append(None)
+    vote_states = {}
+    if current_user.is_authenticated:
+        vote_states = query_vote_states(
+            current_user.id, [story.id for story in stories]
+        )
+    publish_times = [calculate_publish_time(story.time) for story in stories]
+    like_statuses = [vote_states.get(story.id) for story in stories]
 
-    return zip(range(1, len(stories) + 1), stories, publish_times, like_statuses)
+    ranks = ranks or range(1, len(stories) + 1)
+    return zip(ranks, stories, publish_times, like_statuses)
 
 
 def calculate_publish_time(timestamp):
@@ -77,32 +107,47 @@ def set_current_user(endpoint, values):
 
 
 @home.route("/")
+@read_only
 def index():
     """
-    Index route that shows homepage with the top stories
+    Index route that shows homepage with a page of a feed's stories. The feed
+    is chosen with '?feed=' and the page with '?after=', the rank of the last
+    story on the previous page
 
     Returns:
         Returns home.html
     """
     num_stories = 20
-
-    numbered_stories = zip_stories(stories=query_top_stories(num_stories))
+    feed = request.args.get("feed", "top")
+    if feed not in get_ingest_feeds():
+        abort(404)
+    after = request.args.get("after", 0, type=int)
+
+    ranked_stories = query_feed_stories(feed=feed, after=after, count=num_stories)
+    ranks = [rank for rank, _ in ranked_stories]
+    numbered_stories = zip_stories(
+        stories=[story for _, story in ranked_stories], ranks=ranks
+    )
     return render_template(
         "home.html",
         stories=numbered_stories,
+        feeds={feed: FEED_TITLES[feed] for feed in get_ingest_feeds()},
+        feed=feed,
+        # Only links to a next page when this one is full
+        next_after=ranks[-1] if len(ranks) == num_stories else None,
     )
 
 
 @home.route("/update")
 def update():
     """
-    Route that updates the database with Hacker News data
+    Route that submits a job to update the database with Hacker News data, or
+    joins the one already running
 
     Returns:
-        Redirects to the index route
+        Returns 202 with JSON of the job
     """
-    asyncio.run(update_data())
-    return redirect(url_for(endpoint="home.index"))
+    return submitted_response(*submit_refresh())
 
 
 @home.route("/update/comments")
@@ -110,15 +155,50 @@ def update():
 @login_required
 def update_comments():
     """
-    Route that gets the comments for each story in the database from Hacker
-    News API
+    Route that submits a job to get the comments for each story in the
+    database from Hacker News API, or joins the one already running
+
+    Returns:
+        Returns 202 with JSON of the job
+    """
+    return submitted_response(*submit_refresh(kind="comments"))
+
+
+@home.route("/update/jobs/<job_id>")
+@read_only
+def update_status(job_id):
+    """
+    Route that shows the progress and timing of an update job
+
+    Parameters:
+        job_id (string): ID of the job
 
     Returns:
-        Returns JSON of the time it took to update database with comments
+        Returns JSON of the job
+    """
+    if not (job := get_refresh_job(job_id)):
+        abort(404)
+    return serialize_refresh_job(job)
+
+
+def submitted_response(job, joined):
     """
-    start = time()
-    asyncio.run(update_data(comments=True))
-    return {"time_taken": f"{round(time() - start, 3)}"}
+    Build the response of a route that submitted an update job
+
+    Parameters:
+        job (RefreshJob): The submitted or joined job
+        joined (bool): Whether the job was already in flight
+
+    Returns:
+        A 202 response with JSON of the job and the url to poll it at
+    """
+    status_url = url_for("home.update_status", job_id=job.id)
+    response = jsonify(
+        {**serialize_refresh_job(job), "joined": joined, "status_url": status_url}
+    )
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    return response
 
 
 @home.route("/logout")
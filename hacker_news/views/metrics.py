@@ -0,0 +1,25 @@
+"""
+Defines the route Prometheus scrapes ingestion metrics from
+
+Methods:
+    index()
+
+Variables:
+    metrics
+"""
+
+from flask import Blueprint, Response
+from ..utilities import metrics_registry
+
+metrics = Blueprint("metrics", __name__)
+
+
+@metrics.route("/metrics")
+def index():
+    """
+    Route that shows the metrics of every worker process
+
+    Returns:
+        Returns the metrics in the Prometheus text format
+    """
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
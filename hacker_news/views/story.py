@@ -22,10 +22,12 @@ from .home import calculate_publish_time
 from ..utilities import (
     query_story,
     query_comments,
+    query_vote_states,
     admin_required,
     edit_story,
     delete_story,
 )
+from ..db import read_only
 
 story = Blueprint("story", __name__, url_prefix="/story/<id>")
 
@@ -67,21 +69,16 @@ def set_current_user(endpoint, values):
     """
     g.current_user = current_user
     if story := query_story(values.get("id", "")):
-        g.story = query_story(story.id)
+        g.story = story
         g.comments = query_comments(story.id)
         g.publish_time = calculate_publish_time(story.time)
-        g.like_statuses = None
+        g.like_status = None
         if current_user.is_authenticated:
-            liked_story = current_user.has_liked_story(story.id)
-            if liked_story:
-                g.like_status = liked_story.type
-            else:
-                g.like_statuses = None
-        else:
-            g.like_statuses = None
+            g.like_status = query_vote_states(current_user.id, [story.id]).get(story.id)
 
 
 @story.route("/")
+@read_only
 @story_exists
 def index(id):
     """
@@ -0,0 +1,46 @@
+"""
+Fixtures shared by the tests. Apps run against a database in a temporary
+directory and a local replay server standing in for the Hacker News API
+"""
+
+import pytest
+from hacker_news import create_app
+from hacker_news.utilities.item_cache import item_cache
+from hacker_news.utilities.replay_server import ReplayServer, make_synthetic_fixtures
+
+
+@pytest.fixture
+def fixtures():
+    return make_synthetic_fixtures(stories=10, depth=1, fanout=2)
+
+
+@pytest.fixture
+def replay_server(fixtures):
+    server = ReplayServer(fixtures)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def make_app(tmp_path, replay_server):
+    def make_app(**config):
+        # The item cache is shared by the whole process
+        item_cache.clear()
+        return create_app(
+            {
+                "TESTING": True,
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/database.db",
+                "HN_API_URL": replay_server.url,
+                "SCHEDULER_ENABLED": False,
+                "KEYWORD_EXTRACTION": False,
+                "KEYWORD_CACHE_PATH": str(tmp_path / "keyword_cache.db"),
+                "METRICS_PATH": str(tmp_path / "metrics.db"),
+                "REFRESH_LOCK_PATH": str(tmp_path / "refresh.lock"),
+                "SCHEDULER_LOCK_PATH": str(tmp_path / "scheduler.lock"),
+                "ARCHIVE_PATH": str(tmp_path / "archive"),
+                **config,
+            }
+        )
+
+    return make_app
@@ -0,0 +1,48 @@
+from time import time
+from hacker_news.db import db, RefreshJob
+from hacker_news.utilities import adaptive_schedule
+
+
+def add_refreshes(cost, count=3):
+    now = time()
+    for i in range(count):
+        db.session.add(
+            RefreshJob(
+                id=f"job{i}",
+                kind="stories",
+                status="succeeded",
+                submitted_at=now - 60,
+                started_at=now - 60,
+                finished_at=now - 30,
+                items_queried=cost,
+            )
+        )
+    db.session.commit()
+
+
+def test_costly_refreshes_stay_within_max_interval(make_app):
+    app = make_app(
+        API_REQUEST_BUDGET=1000, REFRESH_MAX_INTERVAL=900, REFRESH_INTERVAL=300
+    )
+    with app.app_context():
+        # Meeting the budget would take an hour between refreshes
+        add_refreshes(cost=1000)
+
+        interval = adaptive_schedule.compute_refresh_interval(0.0, 0.0, 300)
+
+        assert interval == 900
+        assert not adaptive_schedule.refresh_fits_budget()
+
+
+def test_budget_lengthens_interval_below_max_interval(make_app):
+    app = make_app(
+        API_REQUEST_BUDGET=10000, REFRESH_MAX_INTERVAL=900, REFRESH_INTERVAL=300
+    )
+    with app.app_context():
+        add_refreshes(cost=1000, count=1)
+
+        # A busy front page asks for the minimum, the budget allows one every 360s
+        interval = adaptive_schedule.compute_refresh_interval(1.0, 1000.0, 60)
+
+        assert interval == 360
+        assert adaptive_schedule.refresh_fits_budget()
@@ -0,0 +1,21 @@
+import asyncio
+from hacker_news.db import db, can_read
+from hacker_news.utilities import news_api
+
+
+def test_read_only_views_read_a_fresh_wal_database(make_app, tmp_path):
+    app = make_app()
+    with app.app_context():
+        asyncio.run(news_api.update_data())
+        # Closing every connection checkpoints the WAL and removes -wal and -shm
+        for engine in db.engines.values():
+            engine.dispose()
+    assert not (tmp_path / "database.db-wal").exists()
+    assert not (tmp_path / "database.db-shm").exists()
+
+    response = app.test_client().get("/")
+
+    assert response.status_code == 200
+    assert b"Synthetic story" in response.data
+    with app.app_context():
+        assert can_read(db.engines["read_only"])
@@ -0,0 +1,26 @@
+from time import sleep
+from hacker_news.db import db, Story
+from hacker_news.utilities.keywords import keyword_extractor
+
+
+def test_create_data_command_extracts_pending_keywords(make_app, tmp_path, monkeypatch):
+    def extract(titles):
+        # Slow enough that the command exits while the background thread runs
+        sleep(0.2)
+        return ["keyword" for _ in titles]
+
+    monkeypatch.setattr(keyword_extractor, "extract", extract)
+    # The command checks for the database at its default path
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "hacker_news" / "db").mkdir(parents=True)
+    (tmp_path / "hacker_news" / "db" / "database.db").touch()
+    app = make_app(KEYWORD_EXTRACTION=True, KEYWORD_WORKERS=0)
+
+    result = app.test_cli_runner().invoke(args=["create-data"])
+
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        stories = db.session.scalars(db.select(Story)).all()
+        assert stories
+        assert not [story for story in stories if story.keywords_pending]
+        assert {story.keywords for story in stories} == {"keyword"}
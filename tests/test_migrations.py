@@ -0,0 +1,80 @@
+import sqlite3
+from hacker_news.db import db
+from hacker_news.db.migrations import MIGRATIONS, get_schema_version
+from hacker_news.utilities import query_feed_stories
+
+# Schema of a database created by the first release, before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE website_settings (
+    id VARCHAR NOT NULL,
+    status VARCHAR,
+    PRIMARY KEY (id)
+);
+CREATE TABLE user (
+    id VARCHAR NOT NULL,
+    email VARCHAR,
+    name VARCHAR,
+    nickname VARCHAR,
+    role VARCHAR,
+    PRIMARY KEY (id),
+    UNIQUE (email)
+);
+CREATE TABLE stories (
+    id INTEGER NOT NULL,
+    title VARCHAR,
+    score INTEGER,
+    time INTEGER,
+    author VARCHAR,
+    url VARCHAR,
+    num_comments INTEGER,
+    order_num INTEGER,
+    keywords VARCHAR,
+    PRIMARY KEY (id)
+);
+CREATE TABLE story_association_table (
+    user_id VARCHAR NOT NULL,
+    story_id INTEGER NOT NULL,
+    type VARCHAR,
+    PRIMARY KEY (user_id, story_id),
+    FOREIGN KEY(user_id) REFERENCES user (id),
+    FOREIGN KEY(story_id) REFERENCES stories (id)
+);
+CREATE TABLE comments (
+    id INTEGER NOT NULL,
+    time INTEGER,
+    author VARCHAR,
+    text VARCHAR,
+    type VARCHAR,
+    story_id INTEGER,
+    parent_comment_id INTEGER,
+    PRIMARY KEY (id),
+    FOREIGN KEY(story_id) REFERENCES stories (id),
+    FOREIGN KEY(parent_comment_id) REFERENCES comments (id)
+);
+"""
+
+
+def test_upgrade_baseline_keeps_ranking(make_app, tmp_path):
+    connection = sqlite3.connect(tmp_path / "database.db")
+    connection.executescript(BASELINE_SCHEMA)
+    connection.executemany(
+        "INSERT INTO stories (id, title, score, time, num_comments, order_num) "
+        "VALUES (?, ?, 1, 0, 0, ?)",
+        [(11, "Oldest", 0), (12, "Newest", 2), (13, "Middle", 1)],
+    )
+    connection.commit()
+    connection.close()
+
+    app = make_app()
+
+    with app.app_context():
+        assert get_schema_version() == len(MIGRATIONS)
+        columns = [c["name"] for c in db.inspect(db.engine).get_columns("stories")]
+        assert "order_num" not in columns
+        ranked = query_feed_stories(feed="top", after=0, count=20)
+        assert [(rank, story.id) for rank, story in ranked] == [
+            (1, 12),
+            (2, 13),
+            (3, 11),
+        ]
+    assert b"Newest" in app.test_client().get("/").data
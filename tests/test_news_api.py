@@ -0,0 +1,94 @@
+import asyncio
+import socket
+import pytest
+from hacker_news.db import db, Story, Comment, RankFetch
+from hacker_news.utilities import news_api
+from hacker_news.utilities.hn_client import FETCH_ERRORS
+from hacker_news.utilities.item_cache import item_cache
+
+
+def test_full_refresh_picks_up_changed_story(make_app, replay_server, fixtures):
+    app = make_app(HN_SYNC_MODE="full")
+    with app.app_context():
+        asyncio.run(news_api.update_data(comments=True))
+
+        story = fixtures["items"][1]
+        story = {
+            **story,
+            "score": story["score"] + 10,
+            "descendants": story["descendants"] + 1,
+            "kids": [*story["kids"], 9999],
+        }
+        replay_server.set_item(story)
+        replay_server.set_item(
+            {
+                "id": 9999,
+                "type": "comment",
+                "by": "someone",
+                "parent": 1,
+                "text": "A new reply",
+                "time": story["time"] + 60,
+                "kids": [],
+            }
+        )
+        asyncio.run(news_api.update_data(comments=True))
+
+        db.session.expire_all()
+        assert db.session.get(Story, 1).score == story["score"]
+        assert db.session.get(Story, 1).num_comments == story["descendants"]
+        assert db.session.get(Comment, 9999) is not None
+
+
+def test_refresh_fails_when_no_feed_is_fetched(make_app):
+    # Nothing listens on a port freed right after binding it
+    with socket.socket() as dead:
+        dead.bind(("127.0.0.1", 0))
+        port = dead.getsockname()[1]
+    app = make_app(HN_API_URL=f"http://127.0.0.1:{port}/v0", HN_API_RETRIES=0)
+    with app.app_context():
+        failed_before = news_api.IDS_FAILED
+        with pytest.raises(FETCH_ERRORS):
+            asyncio.run(news_api.update_data())
+
+        assert news_api.IDS_FAILED - failed_before == len(news_api.FEEDS)
+        assert db.session.scalar(db.select(db.func.count(RankFetch.id))) == 0
+        assert news_api.get_sync_checkpoint() is None
+
+
+def test_update_serves_unchanged_comments_from_cache(make_app, replay_server, fixtures):
+    app = make_app(HN_SYNC_MODE="full")
+    with app.app_context():
+        asyncio.run(news_api.update_data(comments=True))
+
+        # A new reply makes the thread change, so its stored comments are walked
+        story = fixtures["items"][1]
+        old_kids = story["kids"]
+        replay_server.set_item(
+            {
+                **story,
+                "descendants": story["descendants"] + 1,
+                "kids": [*old_kids, 9999],
+            }
+        )
+        replay_server.set_item(
+            {
+                "id": 9999,
+                "type": "comment",
+                "by": "someone",
+                "parent": 1,
+                "text": "A new reply",
+                "time": story["time"] + 60,
+                "kids": [],
+            }
+        )
+        hits_before = item_cache.stats()["hits"]
+        asyncio.run(news_api.update_data(comments=True))
+
+        assert old_kids
+        assert item_cache.stats()["hits"] - hits_before == len(old_kids)
+        assert db.session.get(Comment, 9999) is not None
+
+
+def test_unknown_feed_fails_at_startup(make_app):
+    with pytest.raises(ValueError, match="frontpage"):
+        make_app(HN_FEEDS=["top", "frontpage"])